@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+alarms.py - Server-side bus alarm scheduler
+
+Moves BusAlarmService's threshold logic off the phone. Rather than every
+armed device polling /t3 every 30 seconds, armed alarms live here in a
+timer heap keyed on the predicted time the bus next crosses a 3-minute
+threshold. Each fresh arrivals fetch re-evaluates only the alarms at that
+(stop, route); between fetches advance() fires whatever the heap says is
+due, extrapolating from the last observation.
+
+Semantics match BusAlarmService.kt:
+- an alarm sounds each time the countdown drops below another multiple
+  of ALARM_INTERVAL_SECONDS
+- once it is under ALARM_INTERVAL_SECONDS the final alarm sounds and the
+  alarm disarms itself
+- arming within BOUNDARY_SKIP_SECONDS of a threshold skips that threshold,
+  and threshold alarms stay quiet for ARM_GRACE_SECONDS after arming
+
+Events go to a NotificationSink; ListSink is the local stand-in.
+"""
+
+import heapq
+import itertools
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+ALARM_INTERVAL_SECONDS = 180  # 3 minutes
+ARM_GRACE_SECONDS = 15
+BOUNDARY_SKIP_SECONDS = 30
+
+AlarmEvent = namedtuple('AlarmEvent', 'alarm_id naptan_id route seconds final message')
+
+
+class NotificationSink(ABC):
+    """Receives alarm events. Subclass for push notifications, queues etc."""
+
+    @abstractmethod
+    def notify(self, event):
+        """Deliver one AlarmEvent."""
+
+
+class ListSink(NotificationSink):
+    """Collects events in memory (local testing stand-in)."""
+
+    def __init__(self):
+        self.events = []
+
+    def notify(self, event):
+        self.events.append(event)
+
+
+class Alarm:
+    __slots__ = ('alarm_id', 'naptan_id', 'route', 'index', 'last_threshold',
+                 'armed_at', 'seconds', 'observed_at', 'version')
+
+    def __init__(self, alarm_id, naptan_id, route, index, initial_seconds, now):
+        self.alarm_id = alarm_id
+        self.naptan_id = naptan_id
+        self.route = route
+        self.index = index
+        # Skip the current threshold if we're about to cross it anyway
+        threshold = (initial_seconds // ALARM_INTERVAL_SECONDS) * ALARM_INTERVAL_SECONDS
+        if initial_seconds - threshold < BOUNDARY_SKIP_SECONDS:
+            threshold = max(0, threshold - ALARM_INTERVAL_SECONDS)
+        self.last_threshold = threshold
+        self.armed_at = now
+        self.seconds = initial_seconds
+        self.observed_at = now
+        self.version = 0
+
+    def seconds_at(self, now):
+        """Countdown extrapolated from the last observation."""
+        return self.seconds - (now - self.observed_at)
+
+    def next_crossing(self):
+        """Predicted time the countdown drops below the next alarm point."""
+        target = max(self.last_threshold, ALARM_INTERVAL_SECONDS)
+        # Fires once seconds < target, i.e. just after it reaches target
+        crossing = self.observed_at + (self.seconds - target) + 1
+        if self.last_threshold >= ALARM_INTERVAL_SECONDS:
+            crossing = max(crossing, self.armed_at + ARM_GRACE_SECONDS + 1)
+        return crossing
+
+
+class AlarmEngine:
+    """Armed alarms in a heap ordered by predicted crossing time."""
+
+    def __init__(self, sink, clock=time.time):
+        self.sink = sink
+        self.clock = clock
+        self._alarms = {}
+        self._by_stop = {}   # (naptan_id, route) -> set of alarm ids
+        self._heap = []      # (due, seq, alarm_id, version)
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._alarms)
+
+    def __contains__(self, alarm_id):
+        return alarm_id in self._alarms
+
+    def stops_in_demand(self):
+        """(naptan_id, route) pairs that have at least one armed alarm."""
+        return set(self._by_stop)
+
+    def arm(self, alarm_id, naptan_id, route, index, initial_seconds, now=None):
+        """Arm (or re-arm) an alarm for the index'th bus of route at a stop."""
+        now = self.clock() if now is None else now
+        self.disarm(alarm_id)
+        alarm = Alarm(alarm_id, naptan_id.upper(), route.upper(), index, initial_seconds, now)
+        self._alarms[alarm_id] = alarm
+        self._by_stop.setdefault((alarm.naptan_id, alarm.route), set()).add(alarm_id)
+        self._schedule(alarm)
+        return alarm
+
+    def disarm(self, alarm_id):
+        """Remove an alarm. Its heap entries are dropped lazily."""
+        alarm = self._alarms.pop(alarm_id, None)
+        if alarm is None:
+            return False
+        key = (alarm.naptan_id, alarm.route)
+        ids = self._by_stop.get(key)
+        if ids is not None:
+            ids.discard(alarm_id)
+            if not ids:
+                del self._by_stop[key]
+        return True
+
+    def _schedule(self, alarm):
+        alarm.version += 1
+        heapq.heappush(self._heap, (alarm.next_crossing(), next(self._seq),
+                                    alarm.alarm_id, alarm.version))
+        # Compact once superseded entries dominate the heap
+        if len(self._heap) > 64 and len(self._heap) > 4 * len(self._alarms):
+            self._heap = [entry for entry in self._heap
+                          if entry[2] in self._alarms and self._alarms[entry[2]].version == entry[3]]
+            heapq.heapify(self._heap)
+
+    def _evaluate(self, alarm, seconds, now):
+        """Fire any crossing at this countdown, then reschedule or disarm."""
+        seconds = max(0, int(seconds))
+        minutes = seconds // 60
+        if seconds < ALARM_INTERVAL_SECONDS:
+            self.disarm(alarm.alarm_id)
+            self.sink.notify(AlarmEvent(alarm.alarm_id, alarm.naptan_id, alarm.route,
+                                        seconds, True, f"Bus arriving in {minutes} min"))
+            return
+        threshold = (seconds // ALARM_INTERVAL_SECONDS) * ALARM_INTERVAL_SECONDS
+        if threshold < alarm.last_threshold and now - alarm.armed_at > ARM_GRACE_SECONDS:
+            alarm.last_threshold = threshold
+            self.sink.notify(AlarmEvent(alarm.alarm_id, alarm.naptan_id, alarm.route,
+                                        seconds, False, f"Bus arriving in {minutes} min"))
+        self._schedule(alarm)
+
+    def on_arrivals(self, naptan_id, route_seconds, now=None):
+        """Apply a fresh fetch for one stop.
+
+        route_seconds maps route -> sorted countdowns (t3.seconds_by_route).
+        Only alarms armed on this stop are touched. Returns how many were
+        re-evaluated.
+        """
+        now = self.clock() if now is None else now
+        naptan_id = naptan_id.upper()
+        evaluated = 0
+        for route, seconds_list in route_seconds.items():
+            if not route:
+                continue
+            for alarm_id in list(self._by_stop.get((naptan_id, route.upper()), ())):
+                alarm = self._alarms[alarm_id]
+                if alarm.index >= len(seconds_list):
+                    continue
+                alarm.seconds = seconds_list[alarm.index]
+                alarm.observed_at = now
+                self._evaluate(alarm, alarm.seconds, now)
+                evaluated += 1
+        return evaluated
+
+    def advance(self, now=None):
+        """Fire every alarm whose predicted crossing is due. Returns the count."""
+        now = self.clock() if now is None else now
+        fired = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, _, alarm_id, version = heapq.heappop(self._heap)
+            alarm = self._alarms.get(alarm_id)
+            if alarm is None or alarm.version != version:
+                continue
+            self._evaluate(alarm, alarm.seconds_at(now), now)
+            fired += 1
+        return fired
+
+    def next_due(self):
+        """Earliest live predicted crossing time, or None if nothing is armed."""
+        while self._heap:
+            due, _, alarm_id, version = self._heap[0]
+            alarm = self._alarms.get(alarm_id)
+            if alarm is not None and alarm.version == version:
+                return due
+            heapq.heappop(self._heap)
+        return None
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+compression.py - Accept-Encoding aware response bodies for API Gateway
+
+compress_response() gzips or deflates bodies above COMPRESS_MIN_BYTES when
+the client asks for it, base64-encoding them with isBase64Encoded set as
+API Gateway requires. Compressed bytes are cached by the SHA-1 of the
+uncompressed body, so repeat polls of an unchanged board skip compression.
+
+cached_body() lets a handler skip serialisation too: it keeps the last
+body built for a resource and reuses it while the content it was built
+from compares equal (and it is under max_age seconds old).
+"""
+
+import base64
+import gzip
+import hashlib
+import time
+import zlib
+from collections import OrderedDict
+
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+MAX_CACHED_BODIES = 64
+SUPPORTED_ENCODINGS = ('gzip', 'deflate')
+
+# Compressed (base64) bodies keyed by (body sha1, encoding); Lambda warm starts
+_encoded = OrderedDict()
+
+# Last body per resource key: (built_at, content, body)
+_bodies = {}
+
+
+def negotiate(event):
+    """Pick gzip or deflate from the request's Accept-Encoding, or None.
+
+    '*' only stands for codings not listed by name (RFC 9110), so
+    'gzip;q=0, *' still refuses gzip.
+    """
+    headers = event.get('headers') or {}
+    accept = next((v for k, v in headers.items() if k.lower() == 'accept-encoding'), '')
+    qualities = {}
+    for part in accept.split(','):
+        coding, *params = part.split(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = 0.0
+        qualities[coding] = q
+
+    wildcard = qualities.get('*', 0.0)
+    best, best_q = None, 0.0
+    # Ties go to gzip: it's listed first in SUPPORTED_ENCODINGS
+    for candidate in SUPPORTED_ENCODINGS:
+        q = qualities.get(candidate, wildcard)
+        if q > best_q:
+            best, best_q = candidate, q
+    return best
+
+
+def _compress(data, encoding):
+    if encoding == 'gzip':
+        # mtime=0 keeps output deterministic for identical bodies
+        return gzip.compress(data, COMPRESS_LEVEL, mtime=0)
+    return zlib.compress(data, COMPRESS_LEVEL)
+
+
+def encode_body(body, encoding):
+    """Base64 of body compressed with encoding, from cache when unchanged."""
+    data = body.encode('utf-8')
+    key = (hashlib.sha1(data).digest(), encoding)
+    encoded = _encoded.get(key)
+    if encoded is not None:
+        _encoded.move_to_end(key)
+        return encoded
+    encoded = base64.b64encode(_compress(data, encoding)).decode('ascii')
+    _encoded[key] = encoded
+    if len(_encoded) > MAX_CACHED_BODIES:
+        _encoded.popitem(last=False)
+    return encoded
+
+
+def compress_response(event, response):
+    """Compress an API Gateway proxy response in place if worthwhile."""
+    body = response.get('body')
+    if not body or response.get('isBase64Encoded') or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = negotiate(event)
+    headers = response.setdefault('headers', {})
+    headers['Vary'] = 'Accept-Encoding'
+    if not encoding:
+        return response
+    response['body'] = encode_body(body, encoding)
+    response['isBase64Encoded'] = True
+    headers['Content-Encoding'] = encoding
+    return response
+
+
+def cached_body(key, content, build, max_age=30):
+    """Body for resource key, rebuilt only when content changes or ages out."""
+    now = time.time()
+    cached = _bodies.get(key)
+    if cached and now - cached[0] < max_age and cached[1] == content:
+        return cached[2]
+    body = build()
+    _bodies[key] = (now, content, body)
+    if len(_bodies) > MAX_CACHED_BODIES:
+        _bodies.pop(next(iter(_bodies)))
+    return body
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+deadline.py - End-to-end latency budget for the Lambda handlers
+
+Each handler creates one Deadline per request (?budget_ms=, default
+DEFAULT_BUDGET_MS, never more than the Lambda has left) and passes it down
+through secret lookup, fetch and parse. Socket timeouts shrink to the time
+remaining, so one slow dependency can't burn the whole invocation; when
+the budget runs out the handler serves whatever is ready instead of a 500.
+"""
+
+import time
+
+DEFAULT_BUDGET_MS = 8000     # Lambda timeout is 10s; leave room to respond
+MIN_BUDGET_MS = 100
+MAX_BUDGET_MS = 9500
+LAMBDA_MARGIN_MS = 300       # kept back from context's remaining time
+UPSTREAM_TIMEOUT = 10        # per-call cap, as before deadlines existed
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's latency budget ran out before this step could start."""
+
+
+class Deadline:
+    """A point in time by which the response must be on its way."""
+
+    def __init__(self, budget_ms=DEFAULT_BUDGET_MS, clock=time.monotonic):
+        self.clock = clock
+        self.budget_ms = budget_ms
+        self.expires_at = clock() + budget_ms / 1000
+
+    @classmethod
+    def from_event(cls, event, context=None, clock=time.monotonic):
+        """Budget from ?budget_ms=, clamped to what the Lambda has left."""
+        params = event.get('queryStringParameters') or {}
+        try:
+            budget_ms = int(params.get('budget_ms', DEFAULT_BUDGET_MS))
+        except (TypeError, ValueError):
+            budget_ms = DEFAULT_BUDGET_MS
+        budget_ms = min(max(budget_ms, MIN_BUDGET_MS), MAX_BUDGET_MS)
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            remaining = context.get_remaining_time_in_millis() - LAMBDA_MARGIN_MS
+            budget_ms = max(MIN_BUDGET_MS, min(budget_ms, remaining))
+        return cls(budget_ms, clock)
+
+    def remaining(self):
+        """Seconds left, never negative."""
+        return max(0.0, self.expires_at - self.clock())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, step='request'):
+        """Raise DeadlineExceeded if there's no time left for step."""
+        if self.expired():
+            raise DeadlineExceeded(f"Latency budget of {self.budget_ms}ms exhausted before {step}")
+
+    def timeout(self, cap=UPSTREAM_TIMEOUT, step='upstream call'):
+        """Socket timeout for the next call: time remaining, at most cap."""
+        self.check(step)
+        return min(cap, self.remaining())
+
+
+def upstream_timeout(deadline, step='upstream call'):
+    """Timeout for an optional deadline (the plain cap when there isn't one)."""
+    return deadline.timeout(step=step) if deadline else UPSTREAM_TIMEOUT
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+profiling.py - Opt-in profiling for the Lambda handlers
+
+Wrap a handler with @profiled and set, in the Lambda's environment:
+
+    T3_PROFILE           'sample' (stack sampling) or 'cprofile'; unset = off
+    T3_PROFILE_RATE      fraction of requests to profile (default 1.0)
+    T3_PROFILE_INTERVAL  sampling interval in ms (default 5)
+    T3_PROFILE_DIR       write .collapsed files here (e.g. /tmp); unset = log
+
+Output is in the collapsed-stack format flamegraph.pl and speedscope read:
+one 'frame;frame;frame count' line per distinct stack. Without
+T3_PROFILE_DIR each line is printed as 'PROFILE <handler> <stack> <count>'
+so it can be pulled out of CloudWatch (see LOG_DEBUGGING.md).
+
+cprofile mode has no full stacks, so it writes caller;callee pairs
+weighted by the callee's own time in microseconds.
+
+When T3_PROFILE is unset the decorator returns the handler itself, so the
+disabled path costs nothing. The sampler keeps its own cost under
+MAX_OVERHEAD of wall time by stretching its interval.
+"""
+
+import cProfile
+import functools
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+MODES = ('sample', 'cprofile')
+DEFAULT_INTERVAL_MS = 5
+MIN_INTERVAL_MS = 1
+MAX_OVERHEAD = 0.05      # sampler time as a fraction of wall time
+MAX_SAMPLES = 20000
+
+
+def _frame_name(filename, name):
+    return f"{os.path.basename(filename)}:{name}"
+
+
+class StackSampler:
+    """Samples one thread's stack on a timer until stopped."""
+
+    def __init__(self, thread_id, stop_frame=None, interval_ms=DEFAULT_INTERVAL_MS):
+        self.thread_id = thread_id
+        self.stop_frame = stop_frame
+        self.interval = max(MIN_INTERVAL_MS, interval_ms) / 1000
+        self.stacks = {}
+        self.samples = 0
+        self.cost = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='t3-profiler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+        return self.stacks
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        names = []
+        while frame is not None and frame is not self.stop_frame:
+            code = frame.f_code
+            names.append(_frame_name(code.co_filename, code.co_name))
+            frame = frame.f_back
+        # Anything caught after stop() began is the profiler itself, not the handler
+        if names and not self._stop.is_set():
+            stack = ';'.join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def _run(self):
+        interval = self.interval
+        while not self._stop.wait(interval) and self.samples < MAX_SAMPLES:
+            began = time.perf_counter()
+            self._sample()
+            took = time.perf_counter() - began
+            self.cost += took
+            # Stretch the interval whenever sampling would exceed the overhead bound
+            interval = max(self.interval, took / MAX_OVERHEAD)
+
+
+def cprofile_stacks(profile):
+    """caller;callee -> microseconds of the callee's own time, from cProfile."""
+    stacks = {}
+    for (filename, _, name), (_, _, tt, _, callers) in pstats.Stats(profile).stats.items():
+        callee = _frame_name(filename, name)
+        if not callers:
+            stacks[callee] = stacks.get(callee, 0) + int(tt * 1e6)
+            continue
+        for (c_filename, _, c_name), (_, _, c_tt, _) in callers.items():
+            key = f"{_frame_name(c_filename, c_name)};{callee}"
+            stacks[key] = stacks.get(key, 0) + int(c_tt * 1e6)
+    return {stack: weight for stack, weight in stacks.items() if weight > 0}
+
+
+def emit(handler_name, stacks, output_dir=None):
+    """Write collapsed stacks to output_dir, or print them for the log stream."""
+    lines = [f"{stack} {count}" for stack, count in sorted(stacks.items())]
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"{handler_name}-{int(time.time() * 1000)}-{os.getpid()}.collapsed")
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        print(f"Profile written to {path}")
+        return path
+    for line in lines:
+        print(f"PROFILE {handler_name} {line}")
+    return None
+
+
+def _report(handler_name, collect, output_dir):
+    """emit(collect()), logging rather than raising: a broken profiler must
+    never fail the request it was profiling."""
+    try:
+        emit(handler_name, collect(), output_dir)
+    except Exception as e:
+        print(f"Profiling {handler_name} failed: {type(e).__name__}: {e}")
+
+
+def profiled(handler):
+    """Decorate a Lambda handler with opt-in profiling (see module docstring)."""
+    mode = os.environ.get('T3_PROFILE', '').strip().lower()
+    if mode not in MODES:
+        return handler
+    try:
+        rate = float(os.environ.get('T3_PROFILE_RATE', '1'))
+        interval_ms = float(os.environ.get('T3_PROFILE_INTERVAL', DEFAULT_INTERVAL_MS))
+    except ValueError:
+        print("Invalid T3_PROFILE_RATE / T3_PROFILE_INTERVAL; profiling disabled")
+        return handler
+    if rate <= 0:
+        return handler
+    output_dir = os.environ.get('T3_PROFILE_DIR') or None
+    name = f"{handler.__module__}.{handler.__name__}"
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if rate < 1 and random.random() >= rate:
+            return handler(event, context)
+
+        if mode == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return handler(event, context)
+            finally:
+                profile.disable()
+                _report(name, lambda: cprofile_stacks(profile), output_dir)
+
+        sampler = StackSampler(threading.get_ident(), sys._getframe(), interval_ms).start()
+        try:
+            return handler(event, context)
+        finally:
+            stacks = sampler.stop()
+            print(f"Profiled {name}: {sampler.samples} samples in {sampler.elapsed * 1000:.0f}ms, "
+                  f"sampler overhead {sampler.cost / max(sampler.elapsed, 1e-9):.1%}")
+            _report(name, lambda: stacks, output_dir)
+
+    return wrapper
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+pushport.py - Live departure boards from Darwin Push Port messages
+
+Instead of a GetDepBoardWithDetails SOAP call per view, a long-running
+process consumes Push Port-style incremental XML messages and applies them
+to an in-memory BoardIndex:
+
+- schedule     a service's calling pattern (OR / IP / DT locations)
+- TS           forecasts and actuals for some of its locations
+- deactivated  the service has left the system
+
+BoardIndex.board() then answers a /trains query from memory, returning
+the same Departure records parse_darwin_response builds. Boards are cached
+per (origin, destination) and only rebuilt when a message touches a
+service calling at the origin.
+
+Sources are any iterable of XML messages. FileSource replays a file with
+one message per line; SocketSource reads the same framing from a TCP
+socket. Either is enough to run the whole pipeline locally.
+
+Boards are only trusted while the feed is alive: once no message has been
+applied for MAX_SILENCE_SECONDS, or the consumer thread has exited,
+/trains goes back to SOAP. start_consumer reconnects after source errors.
+
+Locations are TIPLOCs; they map to CRS codes through TIPLOCS and, when
+deployed, a tiplocs.db built by stationdb.py.
+"""
+
+import os
+import socket
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+import stationdb
+from records import Departure
+
+# Commute TIPLOCs; everything else comes from tiplocs.db
+TIPLOCS = {
+    'SURBITN': 'SUR',
+    'WATRLMN': 'WAT',
+    'CLPHMJC': 'CLJ',
+}
+TIPLOC_DB_PATH = os.environ.get(
+    'T3_TIPLOC_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tiplocs.db'))
+
+# Public calling points; OPOR/OPIP/OPDT are operational and PP is passing
+CALLING_TAGS = ('OR', 'IP', 'DT')
+BOARD_WINDOW_MINUTES = 120
+MAX_SILENCE_SECONDS = 120     # Push Port is never this quiet while connected
+RECONNECT_SECONDS = 5
+# Services that never got a deactivated message are pruned by start date.
+# A day's services are kept until this long after midnight so late-night
+# trains still running on the next calendar day aren't dropped.
+PRUNE_INTERVAL_SECONDS = 600
+SERVICE_DAY_ROLLOVER_HOURS = 4
+
+
+def _local(tag):
+    """Tag name without its namespace (Push Port versions its namespaces)."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _minutes(text):
+    """'14:38' or '14:38:30' -> minutes since midnight, or None."""
+    if not text or len(text) < 5 or text[2] != ':':
+        return None
+    try:
+        return int(text[:2]) * 60 + int(text[3:5])
+    except ValueError:
+        return None
+
+
+def tiploc_to_crs(tiploc):
+    """CRS for a TIPLOC, or None if it isn't a known station."""
+    crs = TIPLOCS.get(tiploc)
+    if crs:
+        return crs
+    db = stationdb.open_db(TIPLOC_DB_PATH)
+    record = db.get(tiploc) if db else None
+    return record[0] if record else None
+
+
+class Location:
+    """One public calling point of a service."""
+
+    __slots__ = ('tiploc', 'crs', 'pta', 'ptd', 'eta', 'etd', 'delayed', 'cancelled')
+
+    def __init__(self, tiploc, crs, pta, ptd, cancelled):
+        self.tiploc = tiploc
+        self.crs = crs
+        self.pta = pta
+        self.ptd = ptd
+        self.eta = None
+        self.etd = None
+        self.delayed = False
+        self.cancelled = cancelled
+
+
+class Service:
+    __slots__ = ('rid', 'ssd', 'locations')
+
+    def __init__(self, rid, ssd, locations):
+        self.rid = rid
+        self.ssd = ssd
+        self.locations = locations
+
+
+class BoardIndex:
+    """Services by RID plus, per station, the RIDs that call there."""
+
+    def __init__(self, tiploc_lookup=tiploc_to_crs):
+        self.tiploc_lookup = tiploc_lookup
+        self.services = {}
+        self.by_station = {}      # crs -> set of rids
+        self.versions = {}        # crs -> change counter
+        self._boards = {}         # (origin, destination, now) -> (version, departures)
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.last_message_at = None
+
+    def __len__(self):
+        return len(self.services)
+
+    def covers(self, crs):
+        """True once any service calling at crs has been seen."""
+        return crs.upper() in self.by_station
+
+    def live(self, now=None, max_silence=MAX_SILENCE_SECONDS):
+        """True if a message was applied within the last max_silence seconds."""
+        if self.last_message_at is None:
+            return False
+        now = time.time() if now is None else now
+        return now - self.last_message_at <= max_silence
+
+    def _touch(self, service):
+        for location in service.locations:
+            if location.crs:
+                self.versions[location.crs] = self.versions.get(location.crs, 0) + 1
+
+    def _unlink(self, service):
+        for location in service.locations:
+            rids = self.by_station.get(location.crs)
+            if rids is not None:
+                rids.discard(service.rid)
+
+    def apply(self, message):
+        """Apply one Push Port XML message (str or bytes)."""
+        root = ET.fromstring(message)
+        with self._lock:
+            self.messages += 1
+            self.last_message_at = time.time()
+            for element in root.iter():
+                tag = _local(element.tag)
+                if tag == 'schedule':
+                    self._apply_schedule(element)
+                elif tag == 'TS':
+                    self._apply_forecast(element)
+                elif tag == 'deactivated':
+                    self._remove(element.get('rid'))
+
+    def _apply_schedule(self, element):
+        rid = element.get('rid')
+        locations = []
+        for child in element:
+            if _local(child.tag) not in CALLING_TAGS:
+                continue
+            pta = _minutes(child.get('pta'))
+            ptd = _minutes(child.get('ptd'))
+            if pta is None and ptd is None:
+                continue  # not a public call
+            tiploc = child.get('tpl')
+            locations.append(Location(tiploc, self.tiploc_lookup(tiploc), pta, ptd,
+                                      child.get('can') == 'true'))
+        self._remove(rid)
+        service = Service(rid, element.get('ssd'), locations)
+        self.services[rid] = service
+        for location in locations:
+            if location.crs:
+                self.by_station.setdefault(location.crs, set()).add(rid)
+        self._touch(service)
+
+    def _apply_forecast(self, element):
+        service = self.services.get(element.get('rid'))
+        if service is None:
+            return  # forecasts for services we have no schedule for are useless
+        for child in element:
+            if _local(child.tag) != 'Location':
+                continue
+            location = self._match_location(service, child)
+            if location is None:
+                continue
+            for forecast in child:
+                kind = _local(forecast.tag)
+                if kind not in ('arr', 'dep'):
+                    continue
+                # Actual time wins over estimate
+                minutes = _minutes(forecast.get('at'))
+                if minutes is None:
+                    minutes = _minutes(forecast.get('et'))
+                if kind == 'arr':
+                    location.eta = minutes if minutes is not None else location.eta
+                else:
+                    location.etd = minutes if minutes is not None else location.etd
+                    location.delayed = forecast.get('delayed') == 'true'
+        self._touch(service)
+
+    @staticmethod
+    def _match_location(service, element):
+        tiploc = element.get('tpl')
+        ptd = _minutes(element.get('ptd'))
+        pta = _minutes(element.get('pta'))
+        fallback = None
+        for location in service.locations:
+            if location.tiploc != tiploc:
+                continue
+            if (ptd is None or location.ptd == ptd) and (pta is None or location.pta == pta):
+                return location
+            fallback = fallback or location
+        return fallback
+
+    def _remove(self, rid):
+        service = self.services.pop(rid, None)
+        if service is not None:
+            self._unlink(service)
+            self._touch(service)
+
+    def prune(self, before_ssd):
+        """Drop services whose start date (YYYY-MM-DD) is before before_ssd."""
+        with self._lock:
+            stale = [rid for rid, s in self.services.items() if s.ssd and s.ssd < before_ssd]
+            for rid in stale:
+                self._remove(rid)
+        return len(stale)
+
+    def board(self, origin, destination, now=None, num_services=6,
+              window=BOARD_WINDOW_MINUTES):
+        """Departures from origin calling at destination, soonest first.
+
+        now is minutes since midnight (UK local, like Darwin's times).
+        """
+        origin = origin.upper()
+        destination = destination.upper()
+        if now is None:
+            local = datetime.now(_london())
+            now = local.hour * 60 + local.minute
+        key = (origin, destination, now, num_services, window)
+        with self._lock:
+            version = self.versions.get(origin, 0)
+            cached = self._boards.get(key)
+            if cached and cached[0] == version:
+                return cached[1]
+            departures = self._build_board(origin, destination, now, num_services, window)
+            if len(self._boards) > 256:
+                self._boards.clear()
+            self._boards[key] = (version, departures)
+            return departures
+
+    def _build_board(self, origin, destination, now, num_services, window):
+        candidates = []
+        for rid in self.by_station.get(origin, ()):
+            departure = self._departure(self.services[rid], origin, destination)
+            if departure is None:
+                continue
+            expected = departure.expected if isinstance(departure.expected, int) else departure.std
+            until = (expected - now) % 1440
+            if until <= window:
+                candidates.append((until, departure.std, rid, departure))
+        candidates.sort(key=lambda c: c[:3])
+        return [c[3] for c in candidates[:num_services]]
+
+    @staticmethod
+    def _departure(service, origin, destination):
+        """Departure record matching parse_darwin_response's, or None."""
+        locations = service.locations
+        start = next((i for i, l in enumerate(locations)
+                      if l.crs == origin and l.ptd is not None), None)
+        if start is None:
+            return None
+        end = next((i for i in range(start + 1, len(locations))
+                    if locations[i].crs == destination), None)
+        if end is None:
+            return None
+        dep = locations[start]
+        arr = locations[end]
+        std = dep.ptd
+        arrival = arr.pta if arr.pta is not None else arr.ptd
+
+        cancelled = dep.cancelled
+        delay_mins = 0
+        expected = std
+        if cancelled:
+            status = 'Cancelled'
+        elif dep.etd is not None and dep.etd != std:
+            delay_mins = dep.etd - std
+            if delay_mins < -720:
+                delay_mins += 1440
+            expected = dep.etd
+            status = f"{dep.etd // 60 % 24:02d}:{dep.etd % 60:02d}"
+        elif dep.delayed:
+            status = 'Delayed'
+        else:
+            status = 'On time'
+
+        journey_mins = 0
+        eta = ''
+        if arrival is not None:
+            journey_mins = (arrival - std) % 1440
+            eta = arrival + delay_mins
+        return Departure(std, expected, arrival if arrival is not None else '', eta,
+                         journey_mins, end - start - 1, delay_mins, cancelled, status)
+
+
+def _london():
+    from zoneinfo import ZoneInfo
+    return ZoneInfo('Europe/London')
+
+
+class FileSource:
+    """Replays messages from a file, one XML message per line.
+
+    With follow=True it keeps reading lines appended later (like tail -f),
+    e.g. a log written by a feed bridge, instead of stopping at the end.
+    """
+
+    def __init__(self, path, follow=False, poll_seconds=1.0):
+        self.path = path
+        self.follow = follow
+        self.poll_seconds = poll_seconds
+
+    def __iter__(self):
+        with open(self.path, encoding='utf-8') as f:
+            pending = ''
+            while True:
+                line = f.readline()
+                if not line:
+                    if not self.follow:
+                        break
+                    time.sleep(self.poll_seconds)
+                    continue
+                pending += line
+                if self.follow and not pending.endswith('\n'):
+                    continue  # the writer is mid-line
+                message, pending = pending.strip(), ''
+                if message:
+                    yield message
+
+
+class SocketSource:
+    """Reads newline-framed XML messages from a TCP socket until it closes."""
+
+    def __init__(self, host, port, timeout=None):
+        self.address = (host, port)
+        self.timeout = timeout
+
+    def __iter__(self):
+        with socket.create_connection(self.address, timeout=self.timeout) as sock:
+            with sock.makefile('r', encoding='utf-8') as stream:
+                for line in stream:
+                    line = line.strip()
+                    if line:
+                        yield line
+
+
+def prune_before(now):
+    """Oldest start date (YYYY-MM-DD) still kept at unix time now."""
+    local = datetime.fromtimestamp(now, _london()) - timedelta(hours=SERVICE_DAY_ROLLOVER_HOURS)
+    return local.date().isoformat()
+
+
+def consume(index, source, stop_event=None, clock=time.time):
+    """Apply every message from source to index. Returns how many were applied.
+
+    Every PRUNE_INTERVAL_SECONDS, services from earlier service days are
+    dropped so undeactivated ones don't wrap onto today's boards.
+    """
+    applied = 0
+    last_prune = clock()
+    for message in source:
+        if stop_event is not None and stop_event.is_set():
+            break
+        try:
+            index.apply(message)
+            applied += 1
+        except ET.ParseError as e:
+            print(f"Skipping malformed Push Port message: {e}")
+        now = clock()
+        if now - last_prune >= PRUNE_INTERVAL_SECONDS:
+            last_prune = now
+            pruned = index.prune(prune_before(now))
+            if pruned:
+                print(f"Pruned {pruned} services from earlier days")
+    return applied
+
+
+def run_consumer(index, source, stop_event, reconnect_seconds=RECONNECT_SECONDS):
+    """consume() until source ends or stop_event is set, reconnecting on errors.
+
+    When it returns, /trains stops using index.
+    """
+    import trains
+
+    try:
+        while not stop_event.is_set():
+            try:
+                consume(index, source, stop_event)
+                break
+            except Exception as e:
+                print(f"Push Port consumer failed ({type(e).__name__}: {e}); "
+                      f"reconnecting in {reconnect_seconds}s")
+                stop_event.wait(reconnect_seconds)
+    finally:
+        if trains.live_boards is index:
+            trains.live_boards = None
+        print(f"Push Port consumer stopped after {index.messages} messages")
+
+
+def start_consumer(source, index=None, reconnect_seconds=RECONNECT_SECONDS):
+    """Consume source on a daemon thread and serve /trains from its index.
+
+    Returns (index, thread, stop_event).
+    """
+    import trains
+
+    index = index if index is not None else BoardIndex()
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run_consumer,
+                              args=(index, source, stop_event, reconnect_seconds),
+                              name='pushport', daemon=True)
+    trains.live_boards = index
+    thread.start()
+    return index, thread, stop_event
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Replay Push Port messages into a board')
+    parser.add_argument('replay', help='File with one Push Port XML message per line')
+    parser.add_argument('--from', '-f', dest='from_station', default='sur')
+    parser.add_argument('--to', '-t', dest='to_station', default='wat')
+    parser.add_argument('--now', help='Board time HH:MM (default: now)')
+    args = parser.parse_args()
+
+    index = BoardIndex()
+    count = consume(index, FileSource(args.replay))
+    print(f"Applied {count} messages, {len(index)} services in memory")
+    departures = index.board(args.from_station, args.to_station, now=_minutes(args.now))
+    print(json.dumps([d.to_dict() for d in departures], indent=2))
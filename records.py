@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+records.py - Compact departure and arrival records
+
+Departure and Arrival use __slots__ and keep times as minutes since
+midnight (small ints) rather than formatted strings. The 'HHMM' strings
+the JSON schema uses are only produced when a record is written out, and
+write_json() writes straight into the caller's buffer instead of building
+an intermediate dict per record.
+
+Departure still reads like the old per-service dict (dep['stops'],
+dep.get('eta')), so callers and tests that index by JSON key keep working.
+"""
+
+import json
+from json.encoder import encode_basestring_ascii
+
+
+def hhmm_minutes(text):
+    """'14:38' -> 878. Anything that isn't HH:MM is kept as-is (usually '')."""
+    if text and len(text) == 5 and text[2] == ':' and text[:2].isdigit() and text[3:].isdigit():
+        return int(text[:2]) * 60 + int(text[3:])
+    return text or ''
+
+
+def format_hhmm(value):
+    """878 -> '1438'; non-time strings lose their colons like before."""
+    if isinstance(value, int):
+        hours, minutes = divmod(value % 1440, 60)
+        return f"{hours:02d}{minutes:02d}"
+    return value.replace(':', '')
+
+
+class Departure:
+    """One service on a departure board."""
+
+    __slots__ = ('std', 'expected', 'arrival', 'eta', 'journey_mins', 'stops',
+                 'delay_mins', 'cancelled', 'status')
+
+    # JSON key -> how to produce its value, in schema order
+    FIELDS = (
+        ('scheduledDeparture', lambda d: format_hhmm(d.std)),
+        ('expectedDeparture', lambda d: format_hhmm(d.expected)),
+        ('arrivalTime', lambda d: format_hhmm(d.arrival)),
+        ('eta', lambda d: format_hhmm(d.eta)),
+        ('journeyMins', lambda d: d.journey_mins),
+        ('stops', lambda d: d.stops),
+        ('delayMinutes', lambda d: d.delay_mins),
+        ('cancelled', lambda d: d.cancelled),
+        ('status', lambda d: d.status),
+    )
+    _GETTERS = dict(FIELDS)
+
+    def __init__(self, std, expected, arrival, eta, journey_mins, stops,
+                 delay_mins, cancelled, status):
+        self.std = std
+        self.expected = expected
+        self.arrival = arrival
+        self.eta = eta
+        self.journey_mins = journey_mins
+        self.stops = stops
+        self.delay_mins = delay_mins
+        self.cancelled = cancelled
+        self.status = status
+
+    def __getitem__(self, key):
+        return self._GETTERS[key](self)
+
+    def get(self, key, default=None):
+        getter = self._GETTERS.get(key)
+        return getter(self) if getter else default
+
+    def keys(self):
+        return [key for key, _ in self.FIELDS]
+
+    def __contains__(self, key):
+        return key in self._GETTERS
+
+    def __eq__(self, other):
+        if isinstance(other, Departure):
+            return all(getattr(self, s) == getattr(other, s) for s in self.__slots__)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Departure({self.to_dict()!r})"
+
+    def to_dict(self):
+        return {key: getter(self) for key, getter in self.FIELDS}
+
+    def write_json(self, write):
+        """Write this departure as a JSON object via write (e.g. StringIO.write)."""
+        write('{"scheduledDeparture": "')
+        write(format_hhmm(self.std))
+        write('", "expectedDeparture": "')
+        write(format_hhmm(self.expected))
+        write('", "arrivalTime": "')
+        write(format_hhmm(self.arrival))
+        write('", "eta": "')
+        write(format_hhmm(self.eta))
+        write(f'", "journeyMins": {self.journey_mins:d}, "stops": {self.stops:d}, '
+              f'"delayMinutes": {self.delay_mins:d}, "cancelled": ')
+        write('true' if self.cancelled else 'false')
+        write(', "status": ')
+        # An empty <etd/> leaves no status text; json.dumps wrote null for it
+        write('null' if self.status is None else encode_basestring_ascii(self.status))
+        write('}')
+
+
+def write_departures(departures, write):
+    """Write a JSON array of departures; plain dicts fall back to json.dumps."""
+    write('[')
+    for i, departure in enumerate(departures):
+        if i:
+            write(', ')
+        if isinstance(departure, Departure):
+            departure.write_json(write)
+        else:
+            write(json.dumps(departure))
+    write(']')
+
+
+class Arrival:
+    """One predicted bus arrival at a stop."""
+
+    __slots__ = ('naptan_id', 'line', 'seconds')
+
+    def __init__(self, naptan_id, line, seconds):
+        self.naptan_id = naptan_id
+        self.line = line
+        self.seconds = seconds
+
+    def __eq__(self, other):
+        if not isinstance(other, Arrival):
+            return NotImplemented
+        return (self.naptan_id, self.line, self.seconds) == (other.naptan_id, other.line, other.seconds)
+
+    def __repr__(self):
+        return f"Arrival({self.naptan_id!r}, {self.line!r}, {self.seconds!r})"
+
+
+def _arrival_hook(obj):
+    # Called for every JSON object, innermost first: turn each prediction into
+    # an Arrival as soon as it's decoded so the raw dict is never kept
+    if 'timeToStation' in obj:
+        return Arrival(obj.get('naptanId'), obj.get('lineName'), obj.get('timeToStation', 0))
+    return obj
+
+
+def parse_arrivals(body):
+    """Decode a TfL arrivals JSON array straight into Arrival records."""
+    return [a for a in json.loads(body, object_hook=_arrival_hook) if isinstance(a, Arrival)]
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+server.py - Pre-fork multi-process server for /t3 and /trains
+
+Outside Lambda, a single Python process is GIL-bound once JSON and XML
+parsing dominate, and independent processes would each duplicate caches
+and upstream calls. Here one refresher process renders every response in
+demand through the Lambda handlers and writes it into a SharedCache held
+in multiprocessing.shared_memory; N forked workers only ever read from
+it. Throughput scales with workers while upstream traffic stays that of
+one refresher.
+
+SharedCache is a fixed-layout open-addressed table. Each slot carries a
+seqlock counter: the single writer makes it odd while rewriting the slot
+and even again when done, and readers retry any copy taken while it was
+odd or changed underneath them. Deleted slots become tombstones so probe
+chains past them stay intact, and are reused by later keys.
+
+Keys come from client query strings, so the refresher tracks at most one
+key per slot: keys nobody asked for in DEMAND_WINDOW_SECONDS are deleted,
+and when the table is full the least recently demanded key is evicted.
+
+Workers that miss (or find a stale entry) send the key to the refresher
+over a queue and wait briefly for it to appear; hits re-announce demand
+at most once per DEMAND_PING_SECONDS so the refresher knows which keys to
+keep warm. Each worker serves requests on threads, so one waiting miss
+doesn't hold up that worker's hits.
+
+With a Push Port source (--pushport-file to follow a message log, or
+--pushport HOST:PORT for a socket feed) the refresher process also runs
+pushport.start_consumer, so /trains boards are rendered from memory
+rather than by SOAP while the feed is live.
+
+Run:
+    python server.py --port 8080 --workers 4
+    python server.py --pushport-file pushport.log
+"""
+
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import shared_memory
+from urllib.parse import urlencode, urlsplit, parse_qs
+
+MAGIC = b'T3SC'
+TABLE_HEADER = struct.Struct('<4sII')      # magic, slot count, body bytes per slot
+SLOT_HEADER = struct.Struct('<QdHHI')      # seq, updated_at, status, key length, body length
+KEY_BYTES = 96
+TOMBSTONE = 0xFFFF                         # key length of a deleted slot
+DEFAULT_SLOTS = 256
+DEFAULT_BODY_BYTES = 16 * 1024
+
+REFRESH_INTERVAL_SECONDS = 30
+MAX_AGE_SECONDS = 90          # older entries are treated as misses
+DEMAND_WINDOW_SECONDS = 600   # keys nobody asked for in this long stop refreshing
+DEMAND_PING_SECONDS = 60
+MAX_PINGED_KEYS = DEFAULT_SLOTS   # per-worker record of recent pings, oldest dropped
+MISS_WAIT_SECONDS = 3
+READ_RETRIES = 100
+
+DEFAULT_KEYS = ('t3?stop=parklands', 't3?stop=surbiton', 'trains?from=sur&to=wat',
+                'trains?from=wat&to=sur')
+
+RESPONSE_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Accept',
+    'Access-Control-Allow-Methods': 'GET,OPTIONS'
+}
+
+
+class SharedCache:
+    """Serialised responses by key in shared memory; one writer, many readers."""
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.buf = shm.buf
+        magic, self.slots, self.body_bytes = TABLE_HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Shared memory {shm.name} is not a T3 cache")
+        self.slot_bytes = SLOT_HEADER.size + KEY_BYTES + body_bytes_aligned(self.body_bytes)
+        self._writer_slots = {}
+
+    @classmethod
+    def create(cls, slots=DEFAULT_SLOTS, body_bytes=DEFAULT_BODY_BYTES):
+        slot_bytes = SLOT_HEADER.size + KEY_BYTES + body_bytes_aligned(body_bytes)
+        shm = shared_memory.SharedMemory(create=True, size=TABLE_HEADER.size + slots * slot_bytes)
+        TABLE_HEADER.pack_into(shm.buf, 0, MAGIC, slots, body_bytes)
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _slot_offset(self, i):
+        return TABLE_HEADER.size + i * self.slot_bytes
+
+    def _probe(self, key):
+        start = zlib.crc32(key) % self.slots
+        for n in range(self.slots):
+            yield (start + n) % self.slots
+
+    def _write_slot(self, slot, key, status, body, now):
+        """Seqlocked rewrite of one slot; key None leaves a tombstone."""
+        offset = self._slot_offset(slot)
+        seq = SLOT_HEADER.unpack_from(self.buf, offset)[0]
+        buf = self.buf
+        # Odd sequence: readers back off until the slot is consistent again
+        struct.pack_into('<Q', buf, offset, seq + 1)
+        data_start = offset + SLOT_HEADER.size
+        if key is not None:
+            buf[data_start:data_start + len(key)] = key
+        buf[data_start + KEY_BYTES:data_start + KEY_BYTES + len(body)] = body
+        SLOT_HEADER.pack_into(buf, offset, seq + 1, now,
+                              status, TOMBSTONE if key is None else len(key), len(body))
+        struct.pack_into('<Q', buf, offset, seq + 2)
+
+    def put(self, key, status, body, now=None):
+        """Write a response (writer process only). Returns False if it can't fit."""
+        key = key.encode('utf-8')
+        if len(key) > KEY_BYTES:
+            print(f"Not caching {key!r}: key is longer than {KEY_BYTES} bytes")
+            return False
+        if len(body) > self.body_bytes:
+            print(f"Not caching {key!r}: {len(body)} byte body exceeds slot size")
+            return False
+        slot = self._writer_slots.get(key)
+        if slot is None:
+            # The writer knows every live key, so the first free slot will do
+            for i in self._probe(key):
+                key_len = SLOT_HEADER.unpack_from(self.buf, self._slot_offset(i))[3]
+                if key_len in (0, TOMBSTONE):
+                    slot = i
+                    break
+            else:
+                print(f"Shared cache full; not caching {key!r}")
+                return False
+            self._writer_slots[key] = slot
+        self._write_slot(slot, key, status, body, time.time() if now is None else now)
+        return True
+
+    def delete(self, key):
+        """Free key's slot (writer process only). Returns False if it wasn't cached."""
+        slot = self._writer_slots.pop(key.encode('utf-8'), None)
+        if slot is None:
+            return False
+        self._write_slot(slot, None, 0, b'', 0.0)
+        return True
+
+    def get(self, key):
+        """(status, body, updated_at) for key, or None if it isn't cached."""
+        key = key.encode('utf-8')
+        buf = self.buf
+        for i in self._probe(key):
+            offset = self._slot_offset(i)
+            data_start = offset + SLOT_HEADER.size
+            for _ in range(READ_RETRIES):
+                seq, updated_at, status, key_len, body_len = SLOT_HEADER.unpack_from(buf, offset)
+                if seq & 1:
+                    time.sleep(0)
+                    continue
+                slot_key = (bytes(buf[data_start:data_start + key_len])
+                            if key_len != TOMBSTONE else None)
+                body = bytes(buf[data_start + KEY_BYTES:data_start + KEY_BYTES + body_len]) \
+                    if slot_key == key else None
+                if struct.unpack_from('<Q', buf, offset)[0] == seq:
+                    break
+            else:
+                return None  # writer kept the slot busy; treat as a miss
+            if key_len == 0:
+                return None
+            if slot_key == key:
+                return status, body, updated_at
+        return None
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def body_bytes_aligned(body_bytes):
+    """Round slot bodies up to 8 bytes so every slot header stays aligned."""
+    return (body_bytes + 7) & ~7
+
+
+def _stop_key(stop):
+    """The stop key t3 resolves stop to: a STOPS name or a known NaPTAN ID."""
+    import t3
+
+    config = t3.get_stop_config(stop)
+    return next((name for name, c in t3.STOPS.items() if c is config), config['naptan_id'])
+
+
+def cache_key(path, params):
+    """Normalised cache key for a request, or None if it isn't served here."""
+    path = path.rstrip('/') or '/'
+    if path in ('/', '/t3'):
+        # Resolved like t3 does, so unknown stops share Parklands' entry
+        stops = [s for s in params.get('stop', 'parklands').lower().split(',') if s] or ['parklands']
+        return 't3?' + urlencode({'stop': ','.join(_stop_key(s) for s in stops)}, safe=',')
+    if path == '/trains':
+        # Encoded so render() parses back exactly the journey that was asked for
+        return 'trains?' + urlencode({'from': params.get('from', 'sur').lower(),
+                                      'to': params.get('to', 'wat').lower()})
+    return None
+
+
+def render(key):
+    """Run the Lambda handler for a cache key. Returns (status, body bytes)."""
+    import t3
+    import trains
+
+    name, _, query = key.partition('?')
+    params = {k: v[0] for k, v in parse_qs(query).items()}
+    handler = t3.lambda_handler if name == 't3' else trains.lambda_handler
+    # No Accept-Encoding: workers compress per client
+    response = handler({'queryStringParameters': params, 'headers': {}}, None)
+    return response['statusCode'], response['body'].encode('utf-8')
+
+
+def run_refresher(cache, demand, stop_event, render=render, keys=DEFAULT_KEYS,
+                  interval=REFRESH_INTERVAL_SECONDS, feed=None):
+    """The single writer: keep every key in demand fresh in the cache.
+
+    feed is an optional Push Port source consumed in this process, where
+    render() runs, so trains.live_boards is set where it is read.
+    """
+    if feed is not None:
+        from pushport import start_consumer
+        start_consumer(feed)
+    now = time.time()
+    demanded = {key: now for key in keys}   # key -> last time a worker asked
+    due = {key: 0 for key in keys}
+
+    def forget(key):
+        del due[key], demanded[key]
+        cache.delete(key)
+
+    while not stop_event.is_set():
+        now = time.time()
+        for key in list(due):
+            if key not in keys and now - demanded[key] > DEMAND_WINDOW_SECONDS:
+                forget(key)
+                continue
+            if due[key] > now:
+                continue
+            try:
+                status, body = render(key)
+                cache.put(key, status, body)
+            except Exception as e:
+                print(f"Error refreshing {key}: {type(e).__name__}: {e}")
+            due[key] = time.time() + interval
+
+        # Sleep until the next refresh is due, waking early for new demand
+        timeout = max(0.0, min(due.values(), default=now + interval) - time.time())
+        try:
+            key = demand.get(timeout=min(timeout, 1.0))
+        except queue.Empty:
+            continue
+        while True:
+            if key not in due:
+                if len(due) >= cache.slots:
+                    # Full: make room by dropping the least recently demanded key
+                    evictable = [k for k in demanded if k not in keys]
+                    if evictable:
+                        forget(min(evictable, key=demanded.get))
+                due[key] = 0
+            demanded[key] = time.time()
+            try:
+                key = demand.get_nowait()
+            except queue.Empty:
+                break
+
+
+class WorkerHandler(BaseHTTPRequestHandler):
+    cache = None
+    demand = None
+    pinged = None       # OrderedDict key -> last ping, capped at MAX_PINGED_KEYS
+    pinged_lock = None
+
+    def log_message(self, format, *args):
+        pass  # one line per request would dominate at any real load
+
+    def _announce(self, key, force=False):
+        """Tell the refresher key is wanted, at most once per DEMAND_PING_SECONDS."""
+        now = time.time()
+        with self.pinged_lock:
+            if not force and now - self.pinged.get(key, 0) < DEMAND_PING_SECONDS:
+                return
+            self.pinged[key] = now
+            self.pinged.move_to_end(key)
+            if len(self.pinged) > MAX_PINGED_KEYS:
+                self.pinged.popitem(last=False)
+        self.demand.put(key)
+
+    def _lookup(self, key):
+        entry = self.cache.get(key)
+        if entry and time.time() - entry[2] <= MAX_AGE_SECONDS:
+            self._announce(key)
+            return entry
+        # Miss or stale: ask the refresher and wait a moment for it
+        self._announce(key, force=True)
+        deadline = time.time() + MISS_WAIT_SECONDS
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = self.cache.get(key)
+            if entry and time.time() - entry[2] <= MAX_AGE_SECONDS:
+                return entry
+        return None
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in {**RESPONSE_HEADERS, **(headers or {})}.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        from compression import compress_response
+        import base64
+        import json
+
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        key = cache_key(url.path, params)
+        if key is None:
+            self._send(404, json.dumps({'error': 'Not found'}).encode())
+            return
+        entry = self._lookup(key)
+        if entry is None:
+            self._send(503, json.dumps({'error': 'Not ready yet'}).encode(), {'Retry-After': '1'})
+            return
+
+        status, body, _ = entry
+        response = compress_response({'headers': dict(self.headers)},
+                                     {'statusCode': status, 'body': body.decode('utf-8'), 'headers': {}})
+        payload = (base64.b64decode(response['body']) if response.get('isBase64Encoded')
+                   else response['body'].encode('utf-8'))
+        self._send(status, payload, response['headers'])
+
+
+def run_worker(listener, cache, demand):
+    """Serve HTTP on the inherited listening socket, reading only from cache."""
+    handler = type('BoundWorkerHandler', (WorkerHandler,),
+                   {'cache': cache, 'demand': demand, 'pinged': OrderedDict(),
+                    'pinged_lock': threading.Lock()})
+    server = ThreadingHTTPServer(listener.getsockname(), handler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = listener
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def serve(host='0.0.0.0', port=8080, workers=None, render=render, keys=DEFAULT_KEYS,
+          ready=None, stop_event=None, feed=None):
+    """Pre-fork: one refresher plus `workers` readers on one listening socket."""
+    import multiprocessing
+
+    ctx = multiprocessing.get_context('fork')
+    workers = workers or os.cpu_count() or 1
+    cache = SharedCache.create()
+    demand = ctx.Queue()
+    stop_event = stop_event or ctx.Event()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+
+    processes = [ctx.Process(target=run_refresher, args=(cache, demand, stop_event, render, keys),
+                             kwargs={'feed': feed}, name='t3-refresher', daemon=True)]
+    processes += [ctx.Process(target=run_worker, args=(listener, cache, demand),
+                              name=f't3-worker-{i}', daemon=True) for i in range(workers)]
+    for process in processes:
+        process.start()
+    print(f"Serving on {listener.getsockname()} with {workers} workers")
+    if ready is not None:
+        ready(listener.getsockname())
+    try:
+        stop_event.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        for process in processes:
+            process.terminate()
+            process.join()
+        listener.close()
+        cache.close()
+        cache.unlink()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Multi-process T3 server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: one per core)')
+    feeds = parser.add_mutually_exclusive_group()
+    feeds.add_argument('--pushport-file', metavar='PATH',
+                       help='Follow a Push Port message log (one XML message per line)')
+    feeds.add_argument('--pushport', metavar='HOST:PORT',
+                       help='Read newline-framed Push Port messages from a socket')
+    args = parser.parse_args()
+
+    feed = None
+    if args.pushport_file or args.pushport:
+        from pushport import FileSource, SocketSource
+        if args.pushport_file:
+            feed = FileSource(args.pushport_file, follow=True)
+        else:
+            feed_host, _, feed_port = args.pushport.rpartition(':')
+            feed = SocketSource(feed_host, int(feed_port))
+    serve(args.host, args.port, args.workers, feed=feed)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+stationdb.py - Memory-mapped station and stop metadata lookups
+
+Compiles reference data (CRS codes, NaPTAN stops) into a compact sorted
+binary file, then looks keys up by binary search over an mmap of that file.
+Nothing is parsed at open time, so cold-start cost stays flat however big
+the dataset gets - only the pages a lookup touches are ever read.
+
+File layout (little-endian):
+    header   4s magic 'T3DB', H version, H field count, I record count
+    index    record count x I absolute offset of each record, sorted by key
+    records  key 0x1f field 0x1f field ... 0x0a
+
+Build:
+    python stationdb.py stations RailReferences.csv metadata/stations.db
+    python stationdb.py tiplocs RailReferences.csv metadata/tiplocs.db
+    python stationdb.py stops Stops.csv metadata/stops.db
+
+trains.py and t3.py look for stations.db / stops.db next to themselves, or
+wherever T3_STATION_DB / T3_STOP_DB point. terraform/main.tf ships
+metadata/*.db as a Lambda layer and points both variables under /opt; if
+nothing was built there the layer is skipped, and the handlers fall back
+to the hardcoded commute stations and stops.
+"""
+
+import csv
+import mmap
+import os
+import struct
+
+MAGIC = b'T3DB'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+OFFSET = struct.Struct('<I')
+FIELD_SEP = b'\x1f'
+RECORD_END = b'\n'
+
+# Open databases, keyed by path (Lambda cold start only)
+_open_dbs = {}
+
+
+class StationDB:
+    """Read-only view of a compiled metadata file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.num_fields, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a version {VERSION} station database")
+        self._index_start = HEADER.size
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def _record_offset(self, i):
+        return OFFSET.unpack_from(self._mm, self._index_start + i * OFFSET.size)[0]
+
+    def _key_at(self, i):
+        start = self._record_offset(i)
+        return self._mm[start:self._mm.find(FIELD_SEP, start)]
+
+    def get(self, key, default=None):
+        """Return the field tuple stored for key (case-insensitive), or default."""
+        target = key.strip().upper().encode('utf-8')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.count or self._key_at(lo) != target:
+            return default
+        start = self._record_offset(lo)
+        end = self._mm.find(RECORD_END, start)
+        fields = self._mm[start:end].decode('utf-8').split('\x1f')
+        return tuple(fields[1:])
+
+    def close(self):
+        self._mm.close()
+
+
+def open_db(path):
+    """Open (and cache) the database at path, or return None if it isn't there."""
+    db = _open_dbs.get(path)
+    if db is not None:
+        return db
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        db = StationDB(path)
+    except (OSError, ValueError) as e:
+        print(f"Error opening station database {path}: {e}")
+        return None
+    _open_dbs[path] = db
+    return db
+
+
+def _clean(value):
+    """Strip a field and drop the separator bytes the file format reserves."""
+    return (value or '').replace('\x1f', ' ').replace('\n', ' ').strip()
+
+
+def build(records, path):
+    """Compile (key, fields) pairs into a database file at path.
+
+    Keys are upper-cased; on duplicate keys the last record wins. Every
+    record must carry the same number of fields.
+    """
+    rows = {}
+    num_fields = None
+    for key, fields in records:
+        fields = tuple(_clean(f) for f in fields)
+        if num_fields is None:
+            num_fields = len(fields)
+        elif len(fields) != num_fields:
+            raise ValueError(f"Record {key!r} has {len(fields)} fields, expected {num_fields}")
+        key = _clean(key).upper()
+        if key:
+            rows[key.encode('utf-8')] = fields
+
+    keys = sorted(rows)
+    body = bytearray()
+    offsets = []
+    data_start = HEADER.size + OFFSET.size * len(keys)
+    for key in keys:
+        offsets.append(data_start + len(body))
+        body += FIELD_SEP.join([key] + [f.encode('utf-8') for f in rows[key]])
+        body += RECORD_END
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, num_fields or 0, len(keys)))
+        for offset in offsets:
+            f.write(OFFSET.pack(offset))
+        f.write(body)
+    os.replace(tmp_path, path)
+    return len(keys)
+
+
+def station_records(csv_path):
+    """Yield (CRS, (name,)) from a NaPTAN RailReferences.csv."""
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            crs = row.get('CrsCode', '')
+            name = row.get('StationName', '')
+            if name.endswith(' Rail Station'):
+                name = name[:-len(' Rail Station')]
+            yield crs, (name,)
+
+
+def tiploc_records(csv_path):
+    """Yield (TIPLOC, (CRS,)) from a NaPTAN RailReferences.csv."""
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            if row.get('CrsCode'):
+                yield row.get('TiplocCode', ''), (row['CrsCode'],)
+
+
+def stop_records(csv_path):
+    """Yield (ATCO code, (name, towards)) from a NaPTAN Stops.csv."""
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            towards = row.get('Towards') or row.get('LocalityName', '')
+            yield row.get('ATCOCode', ''), (row.get('CommonName', ''), towards)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compile station/stop reference data')
+    parser.add_argument('kind', choices=['stations', 'tiplocs', 'stops'],
+                        help='stations/tiplocs: RailReferences.csv, stops: Stops.csv')
+    parser.add_argument('csv_path', help='NaPTAN CSV export')
+    parser.add_argument('db_path', help='Output database file')
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.db_path) or '.', exist_ok=True)
+    reader = {'stations': station_records, 'tiplocs': tiploc_records, 'stops': stop_records}[args.kind]
+    count = build(reader(args.csv_path), args.db_path)
+    print(f"Wrote {count} {args.kind} to {args.db_path}")
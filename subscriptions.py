@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+subscriptions.py - Multi-user subscription registry
+
+Maps users to the things they watch - (stop, route) for buses and
+(from, to) for trains - and reference-counts the distinct upstream keys
+those interests need. A single Refresher then fetches each upstream key
+once per interval and fans the result out to every subscriber, so
+upstream cost scales with distinct stops and station pairs, not users.
+
+Several routes at one stop share an upstream key: TfL returns every
+route's arrivals from a single /StopPoint/{id}/arrivals call. Once enough
+distinct stops are in demand (t3.use_line_fetch) the Refresher switches
+to one /Line/{ids}/Arrivals call for every watched route instead.
+
+MemoryStore is an in-process stand-in for the shared store; anything with
+the same attributes (e.g. a DynamoDB-backed class) can replace it.
+"""
+
+import threading
+import time
+
+import t3
+import trains
+
+REFRESH_INTERVAL_SECONDS = 30
+
+
+def bus_interest(naptan_id, route):
+    """Interest in one route's arrivals at one stop."""
+    return ('bus', naptan_id.upper(), route.upper())
+
+
+def train_interest(origin, destination):
+    """Interest in departures from origin filtered to destination (CRS codes)."""
+    return ('train', origin.upper(), destination.upper())
+
+
+def upstream_key(interest):
+    """The upstream fetch an interest is served from."""
+    if interest[0] == 'bus':
+        return ('bus', interest[1])
+    return interest
+
+
+class MemoryStore:
+    """In-process store for subscriptions and the latest upstream results."""
+
+    def __init__(self):
+        self.subscriptions = {}  # user -> set of interests
+        self.results = {}        # upstream key -> {'fetchedAt', 'data', 'error'}
+
+
+class SubscriptionRegistry:
+    """Users' interests plus a reference count per distinct upstream key."""
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else MemoryStore()
+        self._lock = threading.Lock()
+        self._refcounts = {}
+        for interests in self.store.subscriptions.values():
+            for interest in interests:
+                self._incref(upstream_key(interest))
+
+    def _incref(self, key):
+        self._refcounts[key] = self._refcounts.get(key, 0) + 1
+
+    def _decref(self, key):
+        count = self._refcounts.get(key, 0) - 1
+        if count > 0:
+            self._refcounts[key] = count
+        else:
+            self._refcounts.pop(key, None)
+            self.store.results.pop(key, None)
+
+    def subscribe(self, user, interest):
+        """Add an interest for user. Returns False if it was already there."""
+        with self._lock:
+            interests = self.store.subscriptions.setdefault(user, set())
+            if interest in interests:
+                return False
+            interests.add(interest)
+            self._incref(upstream_key(interest))
+            return True
+
+    def unsubscribe(self, user, interest=None):
+        """Drop one interest for user, or all of them if interest is None."""
+        with self._lock:
+            interests = self.store.subscriptions.get(user, set())
+            dropped = set(interests) if interest is None else interests & {interest}
+            for item in dropped:
+                interests.discard(item)
+                self._decref(upstream_key(item))
+            if not interests:
+                self.store.subscriptions.pop(user, None)
+            return len(dropped)
+
+    def interests(self, user):
+        return set(self.store.subscriptions.get(user, ()))
+
+    def upstream_keys(self):
+        """Distinct upstream keys currently in demand, with subscriber counts."""
+        with self._lock:
+            return dict(self._refcounts)
+
+    def publish(self, key, data, error, fetched_at):
+        """Store a fetch result, unless key lost its last subscriber mid-fetch.
+
+        On error the last good data is kept and served flagged with it.
+        Checked and written under the lock so a concurrent unsubscribe can't
+        be undone. Returns True if the result was stored.
+        """
+        with self._lock:
+            if key not in self._refcounts:
+                return False
+            results = self.store.results
+            cached = results.get(key)
+            if error and cached and cached['data'] is not None:
+                data = cached['data']
+            results[key] = {'fetchedAt': fetched_at, 'data': data, 'error': error}
+            return True
+
+    def bus_routes(self):
+        """Every route any user watches, for line-wide fetches."""
+        with self._lock:
+            return {interest[2] for interests in self.store.subscriptions.values()
+                    for interest in interests if interest[0] == 'bus'}
+
+    def view(self, user):
+        """Latest result for each of user's interests.
+
+        Bus interests get that route's seconds out of the shared stop fetch;
+        train interests get the shared departures list. Interests not fetched
+        yet map to None.
+        """
+        view = {}
+        for interest in self.interests(user):
+            result = self.store.results.get(upstream_key(interest))
+            if result is None:
+                view[interest] = None
+                continue
+            data = result['data']
+            if interest[0] == 'bus' and data is not None:
+                data = data.get(interest[2], [])
+            view[interest] = {
+                'fetchedAt': result['fetchedAt'],
+                'data': data,
+                'error': result['error']
+            }
+        return view
+
+
+def fetch_bus(naptan_id):
+    """Fetch a stop once and split it into per-route seconds."""
+    try:
+        arrivals = t3.fetch_arrivals_from_naptan(naptan_id, t3.get_tfl_api_key())
+    except Exception as e:
+        return None, f"Failed to fetch arrivals: {e}"
+    return {route.upper(): seconds for route, seconds in t3.seconds_by_route(arrivals).items()
+            if route}, None
+
+
+def fetch_bus_lines(routes):
+    """Fetch every stop on routes in one call, as {naptan_id: {route: seconds}}."""
+    try:
+        arrivals = t3.fetch_line_arrivals(routes, t3.get_tfl_api_key())
+    except Exception as e:
+        return None, f"Failed to fetch line arrivals: {e}"
+    return {naptan_id.upper(): {route.upper(): seconds
+                                for route, seconds in t3.seconds_by_route(stop).items() if route}
+            for naptan_id, stop in t3.index_by_stop(arrivals).items() if naptan_id}, None
+
+
+def fetch_train(origin, destination):
+    departures, error = trains.fetch_departures(origin, destination, trains.get_darwin_api_key())
+    return (None, error) if error else (departures, None)
+
+
+class Refresher:
+    """Fetches each distinct upstream key at most once per interval."""
+
+    def __init__(self, registry, fetch_bus=fetch_bus, fetch_train=fetch_train,
+                 interval=REFRESH_INTERVAL_SECONDS, clock=time.time, fetch_lines=fetch_bus_lines):
+        self.registry = registry
+        self.fetch_bus = fetch_bus
+        self.fetch_train = fetch_train
+        self.fetch_lines = fetch_lines
+        self.interval = interval
+        self.clock = clock
+
+    def _fetch(self, key):
+        if key[0] == 'bus':
+            return self.fetch_bus(key[1])
+        return self.fetch_train(key[1], key[2])
+
+    def _stale(self, key, now):
+        cached = self.registry.store.results.get(key)
+        return not cached or now - cached['fetchedAt'] >= self.interval
+
+    def refresh(self):
+        """Refresh every stale key in demand. Returns the number of upstream calls."""
+        keys = list(self.registry.upstream_keys())
+        bus_keys = [key for key in keys if key[0] == 'bus']
+        calls = 0
+
+        # Enough stops in demand: one line-wide call serves every one of them
+        if self.fetch_lines and t3.use_line_fetch(len(bus_keys)):
+            now = self.clock()
+            if any(self._stale(key, now) for key in bus_keys):
+                stops, error = self.fetch_lines(sorted(self.registry.bus_routes()))
+                calls += 1
+                for key in bus_keys:
+                    self.registry.publish(key, None if error else stops.get(key[1], {}), error, now)
+            keys = [key for key in keys if key[0] != 'bus']
+
+        for key in keys:
+            now = self.clock()
+            if not self._stale(key, now):
+                continue
+            data, error = self._fetch(key)
+            calls += 1
+            self.registry.publish(key, data, error, now)
+        return calls
+
+    def run_forever(self, stop_event=None):
+        """Refresh on a fixed cadence until stop_event is set."""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            started = self.clock()
+            try:
+                calls = self.refresh()
+                print(f"Refreshed {calls} upstream keys")
+            except Exception as e:
+                print(f"Error refreshing subscriptions: {type(e).__name__}: {e}")
+            stop_event.wait(max(0, self.interval - (self.clock() - started)))
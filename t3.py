@@ -5,9 +5,17 @@ A minimal Lambda function that returns expected bus arrival intervals for a spec
 """
 
 import json
+import os
+import time
 import urllib.request
 from datetime import datetime, timezone
 
+import stationdb
+from compression import compress_response
+from deadline import Deadline, upstream_timeout
+from profiling import profiled
+from records import Arrival, parse_arrivals
+
 TFL_API_BASE = "https://api.tfl.gov.uk"
 ROUTE = "K2"
 TFL_PARAMETER_NAME = "/berrylands/tfl-api-key"
@@ -15,15 +23,31 @@ REGION = "eu-west-1"
 
 _cached_api_key = None
 
+# Last good result per resolved NaPTAN ID (Lambda warm starts), served when
+# the budget runs out
+_last_good = {}
+
+# Per-line fetching: once this many distinct stops have been asked for within
+# DEMAND_WINDOW_SECONDS, one /Line/{ids}/Arrivals call serves them all
+LINE_FETCH_MIN_STOPS = 3
+DEMAND_WINDOW_SECONDS = 300
+LINE_REFRESH_SECONDS = 30
+
+_stop_demand = {}   # naptan_id -> last requested
+_line_index = {}    # tuple of line ids -> (fetched_at, {naptan_id: [Arrival]})
 
-def get_tfl_api_key():
+
+def get_tfl_api_key(deadline=None):
     """Get TfL API key from Parameter Store."""
     global _cached_api_key
     if _cached_api_key:
         return _cached_api_key
     try:
         import boto3
-        client = boto3.client('ssm', region_name=REGION)
+        from botocore.config import Config
+        timeout = upstream_timeout(deadline, 'TfL API key lookup')
+        client = boto3.client('ssm', region_name=REGION, config=Config(
+            connect_timeout=timeout, read_timeout=timeout, retries={'total_max_attempts': 1}))
         response = client.get_parameter(Name=TFL_PARAMETER_NAME, WithDecryption=True)
         _cached_api_key = response['Parameter']['Value']
         return _cached_api_key
@@ -46,61 +70,165 @@ STOPS = {
         "destination": "Home"
     }
 }
+# Any other NaPTAN ID is looked up in the compiled stop database (see stationdb.py)
+STOP_DB_PATH = os.environ.get(
+    'T3_STOP_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stops.db'))
+
+
+def get_stop_config(stop_key):
+    """Resolve a stop key or NaPTAN ID to its config, defaulting to Parklands."""
+    if stop_key in STOPS:
+        return STOPS[stop_key]
+    db = stationdb.open_db(STOP_DB_PATH)
+    record = db.get(stop_key) if db else None
+    if record:
+        name, towards = record
+        return {"naptan_id": stop_key.upper(), "name": name, "destination": towards}
+    return STOPS["parklands"]
 
 
-def fetch_arrivals_from_naptan(naptan_id, api_key=None):
-    """Fetch arrivals from a single NaPTAN stop."""
-    url = f"{TFL_API_BASE}/StopPoint/{naptan_id}/arrivals"
+def _fetch_tfl_arrivals(path, api_key=None, deadline=None):
+    """GET a TfL arrivals endpoint and decode it into Arrival records."""
+    url = f"{TFL_API_BASE}{path}"
     if api_key:
         url += f"?app_key={api_key}"
 
     req = urllib.request.Request(url)
     req.add_header('User-Agent', 't3-terse-transport-times/1.0')
-    with urllib.request.urlopen(req, timeout=10) as response:
-        return json.loads(response.read().decode())
+    with urllib.request.urlopen(req, timeout=upstream_timeout(deadline, 'TfL fetch')) as response:
+        body = response.read()
+    if deadline:
+        deadline.check('TfL parse')
+    return parse_arrivals(body)
+
+
+def fetch_arrivals_from_naptan(naptan_id, api_key=None, deadline=None):
+    """Fetch arrivals from a single NaPTAN stop as Arrival records."""
+    return _fetch_tfl_arrivals(f"/StopPoint/{naptan_id}/arrivals", api_key, deadline)
+
+
+def fetch_line_arrivals(line_ids, api_key=None, deadline=None):
+    """Fetch arrivals at every stop on the given lines in one call."""
+    return _fetch_tfl_arrivals(f"/Line/{','.join(sorted(line_ids))}/Arrivals", api_key, deadline)
+
 
+def index_by_stop(arrivals):
+    """Split a line-wide fetch into {naptan_id: [Arrival]}."""
+    stops = {}
+    for arrival in arrivals:
+        stops.setdefault(arrival.naptan_id, []).append(arrival)
+    return stops
 
-def fetch_arrivals_for_stop(stop_key, api_key=None):
+
+def stops_in_demand(now=None):
+    """NaPTAN IDs requested within the demand window."""
+    now = time.time() if now is None else now
+    for naptan_id, seen in list(_stop_demand.items()):
+        if now - seen > DEMAND_WINDOW_SECONDS:
+            del _stop_demand[naptan_id]
+    return set(_stop_demand)
+
+
+def use_line_fetch(stop_count):
+    """Fetch per line rather than per stop once enough stops are in demand."""
+    return stop_count >= LINE_FETCH_MIN_STOPS
+
+
+def line_index(line_ids, api_key=None, deadline=None):
+    """Per-stop index for the given lines, refetched every LINE_REFRESH_SECONDS.
+
+    Returns (age_seconds, {naptan_id: [Arrival]}).
+    """
+    key = tuple(sorted(line_ids))
+    cached = _line_index.get(key)
+    now = time.time()
+    if cached and now - cached[0] < LINE_REFRESH_SECONDS:
+        return int(now - cached[0]), cached[1]
+    stops = index_by_stop(fetch_line_arrivals(key, api_key, deadline))
+    _line_index[key] = (now, stops)
+    return 0, stops
+
+
+def arrivals_for_naptan(naptan_id, api_key=None, deadline=None, line_ids=(ROUTE,)):
+    """
+    Arrivals at one stop, per stop or from the line-wide index depending on
+    how many distinct stops are in demand. Line-index countdowns are wound
+    on by the index's age.
+    """
+    _stop_demand[naptan_id] = time.time()
+    if not use_line_fetch(len(stops_in_demand())):
+        return fetch_arrivals_from_naptan(naptan_id, api_key, deadline)
+    age, stops = line_index(line_ids, api_key, deadline)
+    arrivals = stops.get(naptan_id, [])
+    if age:
+        arrivals = [Arrival(a.naptan_id, a.line, max(0, a.seconds - age)) for a in arrivals]
+    return arrivals
+
+
+def seconds_by_route(arrivals, limit=2):
+    """Group Arrival records into the soonest `limit` countdowns per route."""
+    routes = {}
+    for arrival in arrivals:
+        routes.setdefault(arrival.line, []).append(arrival.seconds)
+    return {route: sorted(seconds)[:limit] for route, seconds in routes.items()}
+
+
+def fetch_arrivals_for_stop(stop_key, api_key=None, deadline=None):
     """
     Fetch bus arrivals for a specific stop from TfL API.
     Simplified to single direction per location.
     """
-    stop_config = STOPS.get(stop_key, STOPS["parklands"])
-
-    seconds = []
+    stop_config = get_stop_config(stop_key)
 
     # Fetch arrivals for the configured stop
     try:
-        data = fetch_arrivals_from_naptan(stop_config["naptan_id"], api_key)
-        for arrival in data:
-            if arrival.get('lineName') == ROUTE:
-                seconds.append(arrival.get('timeToStation', 0))
+        data = arrivals_for_naptan(stop_config["naptan_id"], api_key, deadline)
     except Exception as e:
         return None, f"Failed to fetch arrivals: {e}"
 
-    if not seconds:
-        return {"stop": stop_config["name"], "destination": stop_config["destination"], "seconds": []}, None
-
-    # Sort by time and limit to first 3
-    seconds.sort()
-    seconds = seconds[:2]
-
     return {
         "stop": stop_config["name"],
         "destination": stop_config["destination"],
-        "seconds": seconds
+        "seconds": seconds_by_route(data).get(ROUTE, [])
+    }, None
+
+
+def arrivals_with_fallback(stop_key, api_key=None, deadline=None):
+    """
+    Fetch a stop, falling back to its last good result if the fetch fails
+    or the budget runs out. Results carry 'fresh'; stale ones also carry
+    'ageSeconds' and countdowns wound on by that age.
+    """
+    # Keyed by what the stop resolves to, so unknown keys share Parklands' entry
+    naptan_id = get_stop_config(stop_key)["naptan_id"]
+    result, error = fetch_arrivals_for_stop(stop_key, api_key, deadline)
+    if not error:
+        _last_good[naptan_id] = (time.time(), result)
+        return {**result, "fresh": True}, None
+
+    cached = _last_good.get(naptan_id)
+    if not cached:
+        return None, error
+    fetched_at, result = cached
+    age = int(time.time() - fetched_at)
+    print(f"Serving cached {stop_key} ({age}s old): {error}")
+    return {
+        **result,
+        "seconds": [max(0, s - age) for s in result["seconds"]],
+        "fresh": False,
+        "ageSeconds": age
     }, None
 
 
+@profiled
 def lambda_handler(event, context):
     """AWS Lambda entry point."""
-    api_key = get_tfl_api_key()
+    deadline = Deadline.from_event(event, context)
+    api_key = get_tfl_api_key(deadline)
 
-    # Get stop from query params
+    # Get stop(s) from query params: ?stop=parklands or ?stop=parklands,surbiton
     params = event.get('queryStringParameters') or {}
-    stop = params.get('stop', 'parklands')
-
-    result, error = fetch_arrivals_for_stop(stop, api_key)
+    stops = [s for s in params.get('stop', 'parklands').split(',') if s] or ['parklands']
 
     cors_headers = {
         'Access-Control-Allow-Origin': '*',
@@ -108,6 +236,23 @@ def lambda_handler(event, context):
         'Access-Control-Allow-Methods': 'GET,OPTIONS'
     }
 
+    if len(stops) == 1:
+        result, error = arrivals_with_fallback(stops[0], api_key, deadline)
+    else:
+        # Return whichever stops made it inside the budget; the rest are flagged
+        parts = []
+        errors = []
+        for stop in stops:
+            part, part_error = arrivals_with_fallback(stop, api_key, deadline)
+            if part_error:
+                errors.append(part_error)
+                config = get_stop_config(stop)
+                part = {"stop": config["name"], "destination": config["destination"],
+                        "seconds": [], "fresh": False, "error": part_error}
+            parts.append(part)
+        result = {"stops": parts}
+        error = errors[0] if len(errors) == len(stops) else None
+
     if error:
         return {
             'statusCode': 500,
@@ -115,11 +260,11 @@ def lambda_handler(event, context):
             'headers': {'Content-Type': 'application/json', **cors_headers}
         }
 
-    return {
+    return compress_response(event, {
         'statusCode': 200,
         'body': json.dumps(result),
         'headers': {'Content-Type': 'application/json', **cors_headers}
-    }
+    })
 
 
 if __name__ == '__main__':
@@ -59,6 +59,30 @@ resource "aws_iam_role_policy" "lambda_parameter_store" {
   })
 }
 
+# Station/stop metadata compiled by stationdb.py into ../metadata/*.db.
+# Shipped as a layer (unpacked under /opt) since the .db files are binary;
+# with none built the layer is skipped and the handlers use their
+# hardcoded commute stations and stops.
+locals {
+  metadata_dir   = "${path.module}/../metadata"
+  metadata_files = fileset(local.metadata_dir, "*.db")
+}
+
+data "archive_file" "metadata_layer_zip" {
+  count       = length(local.metadata_files) > 0 ? 1 : 0
+  type        = "zip"
+  source_dir  = local.metadata_dir
+  output_path = "${path.module}/metadata.zip"
+}
+
+resource "aws_lambda_layer_version" "metadata" {
+  count               = length(data.archive_file.metadata_layer_zip)
+  layer_name          = "${var.function_name}-metadata"
+  filename            = data.archive_file.metadata_layer_zip[0].output_path
+  source_code_hash    = data.archive_file.metadata_layer_zip[0].output_base64sha256
+  compatible_runtimes = ["python3.12"]
+}
+
 # Lambda function
 resource "aws_lambda_function" "t3" {
   filename         = data.archive_file.lambda_zip.output_path
@@ -69,15 +93,50 @@ resource "aws_lambda_function" "t3" {
   runtime          = "python3.12"
   timeout          = 10
   memory_size      = 128
+  layers           = aws_lambda_layer_version.metadata[*].arn
 
-  # No environment variables needed - Lambda fetches TfL API key from Parameter Store
+  # TfL API key comes from Parameter Store; stops.db (if built) from the metadata layer
+  environment {
+    variables = merge({
+      T3_STOP_DB = "/opt/stops.db"
+    }, var.profiling)
+  }
 }
 
 # Zip the Lambda code
 data "archive_file" "lambda_zip" {
   type        = "zip"
-  source_file = "${path.module}/../t3.py"
   output_path = "${path.module}/t3.zip"
+
+  source {
+    content  = file("${path.module}/../t3.py")
+    filename = "t3.py"
+  }
+
+  source {
+    content  = file("${path.module}/../stationdb.py")
+    filename = "stationdb.py"
+  }
+
+  source {
+    content  = file("${path.module}/../deadline.py")
+    filename = "deadline.py"
+  }
+
+  source {
+    content  = file("${path.module}/../compression.py")
+    filename = "compression.py"
+  }
+
+  source {
+    content  = file("${path.module}/../records.py")
+    filename = "records.py"
+  }
+
+  source {
+    content  = file("${path.module}/../profiling.py")
+    filename = "profiling.py"
+  }
 }
 
 # API Gateway
@@ -127,8 +186,37 @@ resource "aws_lambda_permission" "api_gw" {
 # Zip the trains Lambda code
 data "archive_file" "trains_lambda_zip" {
   type        = "zip"
-  source_file = "${path.module}/../trains.py"
   output_path = "${path.module}/trains.zip"
+
+  source {
+    content  = file("${path.module}/../trains.py")
+    filename = "trains.py"
+  }
+
+  source {
+    content  = file("${path.module}/../stationdb.py")
+    filename = "stationdb.py"
+  }
+
+  source {
+    content  = file("${path.module}/../deadline.py")
+    filename = "deadline.py"
+  }
+
+  source {
+    content  = file("${path.module}/../compression.py")
+    filename = "compression.py"
+  }
+
+  source {
+    content  = file("${path.module}/../records.py")
+    filename = "records.py"
+  }
+
+  source {
+    content  = file("${path.module}/../profiling.py")
+    filename = "profiling.py"
+  }
 }
 
 # Trains Lambda function
@@ -141,8 +229,14 @@ resource "aws_lambda_function" "trains" {
   runtime          = "python3.12"
   timeout          = 10
   memory_size      = 128
+  layers           = aws_lambda_layer_version.metadata[*].arn
 
-  # No environment variables needed - Lambda fetches Darwin API key from Parameter Store
+  # Darwin API key comes from Parameter Store; stations.db (if built) from the metadata layer
+  environment {
+    variables = merge({
+      T3_STATION_DB = "/opt/stations.db"
+    }, var.profiling)
+  }
 }
 
 # Lambda integration for trains
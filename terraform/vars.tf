@@ -8,5 +8,11 @@ variable "function_name" {
   default = "t3"
 }
 
+# T3_PROFILE* settings for both Lambdas (see LOG_DEBUGGING.md); empty = off
+variable "profiling" {
+  type    = map(string)
+  default = {}
+}
+
 # TfL API key is stored in SSM Parameter Store at /berrylands/tfl-api-key
 # Darwin API key is stored in SSM Parameter Store at /berrylands/darwin-api-key
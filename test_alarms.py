@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+pytest tests for alarms.py threshold scheduling
+
+Mirrors the BusAlarmService.kt behaviour: alarms every 3 minutes as the
+bus approaches, a final alarm under 3 minutes, then disarm.
+
+Run with: pytest test_alarms.py -v
+"""
+
+import pytest
+from alarms import AlarmEngine, ListSink, NotificationSink
+
+
+@pytest.fixture
+def engine():
+    return AlarmEngine(ListSink(), clock=lambda: 0)
+
+
+class TestThresholds:
+    """Crossing detection from fresh fetches"""
+
+    def test_threshold_crossing_from_fetch(self, engine):
+        engine.arm('a', '490010781S', 'K2', 0, 600, now=0)   # last threshold 540
+        engine.on_arrivals('490010781S', {'K2': [530]}, now=60)
+        [event] = engine.sink.events
+        assert event.alarm_id == 'a'
+        assert not event.final
+        assert event.message == 'Bus arriving in 8 min'
+
+    def test_final_alarm_disarms(self, engine):
+        engine.arm('a', '490010781S', 'K2', 0, 400, now=0)
+        engine.on_arrivals('490010781S', {'K2': [170]}, now=60)
+        assert engine.sink.events[-1].final
+        assert 'a' not in engine
+        assert engine.stops_in_demand() == set()
+
+    def test_boundary_skip(self, engine):
+        # 550s is within 30s of 540, so 540 is skipped: next alarm is below 360
+        engine.arm('a', '490010781S', 'K2', 0, 550, now=0)
+        engine.on_arrivals('490010781S', {'K2': [500]}, now=60)
+        assert engine.sink.events == []
+        engine.on_arrivals('490010781S', {'K2': [350]}, now=120)
+        assert len(engine.sink.events) == 1
+
+    def test_grace_period_defers_alarm(self, engine):
+        engine.arm('a', '490010781S', 'K2', 0, 600, now=0)
+        engine.on_arrivals('490010781S', {'K2': [530]}, now=5)
+        assert engine.sink.events == []
+        engine.advance(now=20)
+        assert len(engine.sink.events) == 1
+
+    def test_bus_index(self, engine):
+        engine.arm('a', '490010781S', 'K2', 1, 600, now=0)
+        engine.on_arrivals('490010781S', {'K2': [100, 530]}, now=60)
+        [event] = engine.sink.events
+        assert event.seconds == 530 and not event.final
+
+
+class TestTimerHeap:
+    """Predicted crossings fire without a fetch"""
+
+    def test_predicted_crossings(self, engine):
+        engine.arm('a', '490010781S', 'K2', 0, 600, now=0)
+        assert engine.next_due() == 61
+        assert engine.advance(now=60) == 0
+        assert engine.advance(now=61) == 1
+        assert engine.sink.events[-1].seconds == 539
+        engine.advance(now=241)
+        engine.advance(now=421)
+        assert [e.final for e in engine.sink.events] == [False, False, True]
+        assert len(engine) == 0
+        assert engine.next_due() is None
+
+    def test_fetch_reschedules_prediction(self, engine):
+        engine.arm('a', '490010781S', 'K2', 0, 600, now=0)
+        # Bus held in traffic: still 590s out after a minute
+        engine.on_arrivals('490010781S', {'K2': [590]}, now=60)
+        assert engine.advance(now=61) == 0
+        assert engine.next_due() == 60 + 590 - 540 + 1
+
+    def test_only_affected_alarms_reevaluated(self, engine):
+        engine.arm('a', '490010781S', 'K2', 0, 600, now=0)
+        engine.arm('b', '490015165B', 'K2', 0, 600, now=0)
+        engine.arm('c', '490010781S', 'K1', 0, 600, now=0)
+        assert engine.on_arrivals('490010781s', {'k2': [590], 'K3': [100]}, now=30) == 1
+
+    def test_disarm_and_rearm(self, engine):
+        engine.arm('a', '490010781S', 'K2', 0, 600, now=0)
+        assert engine.disarm('a')
+        assert not engine.disarm('a')
+        assert engine.advance(now=1000) == 0
+        engine.arm('a', '490010781S', 'K2', 0, 300, now=1000)
+        engine.advance(now=2000)
+        assert [e.final for e in engine.sink.events] == [True]
+
+    def test_tens_of_thousands_of_alarms(self, engine):
+        for i in range(20000):
+            engine.arm(i, f'4900{i % 500:06d}', 'K2', 0, 600 + i % 900, now=0)
+        assert len(engine.stops_in_demand()) == 500
+        assert engine.on_arrivals('4900000007', {'K2': [700]}, now=10) == 40
+        engine.advance(now=2000)
+        assert len(engine) == 0
+        assert sum(e.final for e in engine.sink.events) == 20000
+
+
+class TestSinks:
+    def test_sink_must_implement_notify(self):
+        class Silent(NotificationSink):
+            pass
+        with pytest.raises(TypeError):
+            Silent()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+pytest tests for compression.py negotiation and caching
+
+Run with: pytest test_compression.py -v
+"""
+
+import base64
+import gzip
+import json
+import zlib
+import pytest
+import compression
+from compression import negotiate, compress_response, cached_body, COMPRESS_MIN_BYTES
+
+
+def event_with(accept_encoding):
+    return {'headers': {'accept-encoding': accept_encoding}}
+
+
+def big_response():
+    departures = [{'scheduledDeparture': f'{1400 + i:04d}', 'status': 'On time'} for i in range(40)]
+    body = json.dumps({'departures': departures})
+    assert len(body) > COMPRESS_MIN_BYTES
+    return {'statusCode': 200, 'body': body, 'headers': {'Content-Type': 'application/json'}}
+
+
+@pytest.fixture(autouse=True)
+def empty_caches(monkeypatch):
+    monkeypatch.setattr(compression, '_encoded', compression.OrderedDict())
+    monkeypatch.setattr(compression, '_bodies', {})
+
+
+class TestNegotiation:
+    """Tests for Accept-Encoding parsing"""
+
+    def test_prefers_gzip(self):
+        assert negotiate(event_with('gzip, deflate, br')) == 'gzip'
+        assert negotiate(event_with('deflate, gzip')) == 'gzip'
+
+    def test_q_values(self):
+        assert negotiate(event_with('gzip;q=0.5, deflate;q=0.9')) == 'deflate'
+        assert negotiate(event_with('gzip;q=0, deflate;q=0')) is None
+
+    def test_wildcard_and_missing(self):
+        assert negotiate(event_with('*')) == 'gzip'
+        assert negotiate(event_with('br, identity')) is None
+        assert negotiate({}) is None
+        assert negotiate({'headers': {'Accept-Encoding': 'deflate'}}) == 'deflate'
+
+    def test_wildcard_excludes_refused_codings(self):
+        assert negotiate(event_with('gzip;q=0, *')) == 'deflate'
+        assert negotiate(event_with('gzip;q=0, deflate;q=0, *;q=1')) is None
+        assert negotiate(event_with('deflate;q=0.5, *;q=0.8')) == 'gzip'
+
+    def test_q_after_other_parameters(self):
+        assert negotiate(event_with('deflate;q=0.5;foo=1')) == 'deflate'
+        assert negotiate(event_with('gzip;foo=1;q=0, deflate')) == 'deflate'
+
+
+class TestCompressResponse:
+    """Tests for API Gateway response handling"""
+
+    def test_gzip_round_trip(self):
+        response = big_response()
+        original = response['body']
+        compress_response(event_with('gzip'), response)
+        assert response['isBase64Encoded'] is True
+        assert response['headers']['Content-Encoding'] == 'gzip'
+        assert response['headers']['Vary'] == 'Accept-Encoding'
+        assert gzip.decompress(base64.b64decode(response['body'])).decode() == original
+
+    def test_deflate_round_trip(self):
+        response = big_response()
+        original = response['body']
+        compress_response(event_with('deflate'), response)
+        assert zlib.decompress(base64.b64decode(response['body'])).decode() == original
+
+    def test_small_or_unrequested_bodies_untouched(self):
+        small = {'statusCode': 200, 'body': '{"seconds": [60]}', 'headers': {}}
+        assert compress_response(event_with('gzip'), small)['body'] == '{"seconds": [60]}'
+        response = big_response()
+        original = response['body']
+        compress_response({}, response)
+        assert response['body'] == original
+        assert 'isBase64Encoded' not in response
+
+    def test_compressed_bytes_cached_by_content(self, monkeypatch):
+        calls = []
+        real_compress = compression._compress
+        monkeypatch.setattr(compression, '_compress',
+                            lambda data, enc: calls.append(enc) or real_compress(data, enc))
+        first = compress_response(event_with('gzip'), big_response())
+        second = compress_response(event_with('gzip'), big_response())
+        assert first['body'] == second['body']
+        assert calls == ['gzip']
+        compress_response(event_with('deflate'), big_response())
+        assert calls == ['gzip', 'deflate']
+
+
+class TestCachedBody:
+    """Tests for skipping serialisation of unchanged content"""
+
+    def test_unchanged_content_reuses_body(self):
+        builds = []
+        build = lambda: builds.append(1) or 'body'
+        assert cached_body('k', [{'a': 1}], build) == 'body'
+        assert cached_body('k', [{'a': 1}], build) == 'body'
+        assert len(builds) == 1
+        cached_body('k', [{'a': 2}], build)
+        assert len(builds) == 2
+
+    def test_aged_body_rebuilt(self):
+        builds = []
+        build = lambda: builds.append(1) or 'body'
+        cached_body('k', [], build, max_age=0)
+        cached_body('k', [], build, max_age=0)
+        assert len(builds) == 2
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+pytest tests for deadline.py budgets and the handlers' partial responses
+
+Run with: pytest test_deadline.py -v
+"""
+
+import json
+import pytest
+import t3
+import trains
+from records import Arrival
+from deadline import Deadline, DeadlineExceeded, DEFAULT_BUDGET_MS, MAX_BUDGET_MS
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+class TestDeadline:
+    """Tests for budget parsing and shrinking timeouts"""
+
+    def test_default_and_clamped_budgets(self):
+        assert Deadline.from_event({}).budget_ms == DEFAULT_BUDGET_MS
+        event = {'queryStringParameters': {'budget_ms': '60000'}}
+        assert Deadline.from_event(event).budget_ms == MAX_BUDGET_MS
+        event = {'queryStringParameters': {'budget_ms': 'soon'}}
+        assert Deadline.from_event(event).budget_ms == DEFAULT_BUDGET_MS
+
+    def test_budget_limited_by_lambda_remaining_time(self):
+        deadline = Deadline.from_event({}, FakeContext(2000))
+        assert deadline.budget_ms == 1700
+
+    def test_timeout_shrinks_to_remaining(self):
+        clock = FakeClock()
+        deadline = Deadline(3000, clock)
+        assert deadline.timeout() == 3
+        clock.now += 2.5
+        assert deadline.timeout() == pytest.approx(0.5)
+        clock.now += 1
+        assert deadline.expired()
+        with pytest.raises(DeadlineExceeded):
+            deadline.timeout(step='Darwin fetch')
+
+
+@pytest.fixture
+def no_cache(monkeypatch):
+    monkeypatch.setattr(t3, '_last_good', {})
+    monkeypatch.setattr(t3, '_stop_demand', {})
+    monkeypatch.setattr(trains, '_last_boards', {})
+    monkeypatch.setattr(t3, 'get_tfl_api_key', lambda deadline=None: 'key')
+    monkeypatch.setattr(trains, 'get_darwin_api_key', lambda deadline=None: 'key')
+
+
+class TestBusPartialResponses:
+    """t3 serves cached or partial stops instead of a 500"""
+
+    def test_stale_result_served_on_timeout(self, no_cache, monkeypatch):
+        arrivals = [Arrival('490010781S', 'K2', 300)]
+        monkeypatch.setattr(t3, 'fetch_arrivals_from_naptan', lambda *a: arrivals)
+        body = json.loads(t3.lambda_handler({}, None)['body'])
+        assert body['fresh'] is True
+        assert body['seconds'] == [300]
+
+        def slow(*args):
+            raise DeadlineExceeded('budget exhausted')
+        monkeypatch.setattr(t3, 'fetch_arrivals_from_naptan', slow)
+        response = t3.lambda_handler({}, None)
+        body = json.loads(response['body'])
+        assert response['statusCode'] == 200
+        assert body['fresh'] is False
+        assert 'ageSeconds' in body
+
+    def test_subset_of_stops(self, no_cache, monkeypatch):
+        def fetch(naptan_id, api_key=None, deadline=None):
+            if naptan_id == t3.STOPS['surbiton']['naptan_id']:
+                raise DeadlineExceeded('budget exhausted')
+            return [Arrival(naptan_id, 'K2', 120)]
+        monkeypatch.setattr(t3, 'fetch_arrivals_from_naptan', fetch)
+        event = {'queryStringParameters': {'stop': 'parklands,surbiton'}}
+        response = t3.lambda_handler(event, None)
+        parklands, surbiton = json.loads(response['body'])['stops']
+        assert response['statusCode'] == 200
+        assert parklands['fresh'] is True and parklands['seconds'] == [120]
+        assert surbiton['fresh'] is False and 'error' in surbiton
+
+    def test_unknown_stops_share_one_cache_entry(self, no_cache, monkeypatch):
+        monkeypatch.setattr(t3, 'fetch_arrivals_from_naptan',
+                            lambda *a: [Arrival('490010781S', 'K2', 300)])
+        for i in range(50):
+            t3.lambda_handler({'queryStringParameters': {'stop': f'junk{i}'}}, None)
+        assert list(t3._last_good) == [t3.STOPS['parklands']['naptan_id']]
+
+    def test_nothing_ready_is_an_error(self, no_cache, monkeypatch):
+        def slow(*args):
+            raise DeadlineExceeded('budget exhausted')
+        monkeypatch.setattr(t3, 'fetch_arrivals_from_naptan', slow)
+        assert t3.lambda_handler({}, None)['statusCode'] == 500
+
+
+class TestTrainPartialResponses:
+    """trains serves the last good board when the budget runs out"""
+
+    def test_cached_board_served(self, no_cache, monkeypatch):
+        monkeypatch.setattr(trains, 'fetch_departures',
+                            lambda *a: ([{'scheduledDeparture': '1438'}], None))
+        body = json.loads(trains.lambda_handler({}, None)['body'])
+        assert body['fresh'] is True
+
+        monkeypatch.setattr(trains, 'fetch_departures', lambda *a: ([], 'timed out'))
+        response = trains.lambda_handler({}, None)
+        body = json.loads(response['body'])
+        assert response['statusCode'] == 200
+        assert body['fresh'] is False
+        assert body['departures'] == [{'scheduledDeparture': '1438'}]
+
+    def test_expired_deadline_skips_fetch(self, no_cache, monkeypatch):
+        def urlopen(*args, **kwargs):
+            raise AssertionError('should not be called')
+        monkeypatch.setattr(trains.urllib.request, 'urlopen', urlopen)
+        deadline = Deadline(0)
+        departures, error = trains.fetch_departures('sur', 'wat', 'key', deadline)
+        assert departures == []
+        assert 'budget' in error
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+pytest tests for profiling.py handler wrapping
+
+Run with: pytest test_profiling.py -v
+"""
+
+import os
+import time
+import timeit
+import pytest
+import t3
+import trains
+from profiling import profiled
+
+
+def busy_handler(event, context):
+    """Spin for a while so the sampler catches us."""
+    end = time.perf_counter() + 0.1
+    while time.perf_counter() < end:
+        busy_inner()
+    return {'statusCode': 200}
+
+
+def busy_inner():
+    return sum(range(200))
+
+
+@pytest.fixture
+def env(monkeypatch):
+    for name in ('T3_PROFILE', 'T3_PROFILE_RATE', 'T3_PROFILE_INTERVAL', 'T3_PROFILE_DIR'):
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+class TestDisabled:
+    """With profiling off the handler is returned untouched"""
+
+    def test_disabled_returns_handler_itself(self, env):
+        assert profiled(busy_handler) is busy_handler
+        env.setenv('T3_PROFILE', 'sample')
+        env.setenv('T3_PROFILE_RATE', '0')
+        assert profiled(busy_handler) is busy_handler
+
+    def test_deployed_handlers_unwrapped_by_default(self):
+        if os.environ.get('T3_PROFILE'):
+            pytest.skip('profiling enabled in this environment')
+        assert not hasattr(t3.lambda_handler, '__wrapped__')
+        assert not hasattr(trains.lambda_handler, '__wrapped__')
+
+    def test_disabled_path_costs_nothing(self, env):
+        def handler(event, context):
+            return None
+        wrapped = profiled(handler)
+        raw = min(timeit.repeat(lambda: handler({}, None), number=20000, repeat=5))
+        off = min(timeit.repeat(lambda: wrapped({}, None), number=20000, repeat=5))
+        assert off < raw * 1.5 + 1e-3
+
+
+class TestEnabled:
+    """Sampling and cProfile modes write collapsed stacks"""
+
+    def test_sampler_writes_collapsed_stacks(self, env, tmp_path):
+        env.setenv('T3_PROFILE', 'sample')
+        env.setenv('T3_PROFILE_INTERVAL', '2')
+        env.setenv('T3_PROFILE_DIR', str(tmp_path))
+        wrapped = profiled(busy_handler)
+        assert wrapped({}, None) == {'statusCode': 200}
+        [path] = tmp_path.glob('*.collapsed')
+        lines = path.read_text().splitlines()
+        assert lines
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            assert int(count) > 0
+            # Rooted at the handler, not the wrapper or pytest
+            assert stack.startswith('test_profiling.py:busy_handler')
+        assert any('busy_inner' in line for line in lines)
+
+    def test_cprofile_to_log_stream(self, env, capsys):
+        env.setenv('T3_PROFILE', 'cprofile')
+        profiled(busy_handler)({}, None)
+        out = capsys.readouterr().out
+        assert 'PROFILE test_profiling.busy_handler test_profiling.py:busy_handler;test_profiling.py:busy_inner ' in out
+
+    def test_sampled_fraction(self, env, tmp_path, monkeypatch):
+        env.setenv('T3_PROFILE', 'sample')
+        env.setenv('T3_PROFILE_RATE', '0.5')
+        env.setenv('T3_PROFILE_DIR', str(tmp_path))
+        wrapped = profiled(lambda event, context: 'ok')
+        monkeypatch.setattr('profiling.random.random', lambda: 0.9)
+        assert wrapped({}, None) == 'ok'
+        assert list(tmp_path.glob('*.collapsed')) == []
+
+    def test_handler_errors_still_propagate(self, env, tmp_path):
+        env.setenv('T3_PROFILE', 'sample')
+        env.setenv('T3_PROFILE_DIR', str(tmp_path))
+
+        def failing(event, context):
+            raise RuntimeError('boom')
+        with pytest.raises(RuntimeError):
+            profiled(failing)({}, None)
+
+    @pytest.mark.parametrize('mode', ['sample', 'cprofile'])
+    def test_profiler_failure_never_fails_request(self, env, tmp_path, capsys, mode):
+        blocker = tmp_path / 'file'
+        blocker.write_text('')
+        env.setenv('T3_PROFILE', mode)
+        env.setenv('T3_PROFILE_DIR', str(blocker / 'profiles'))  # can't be created
+        assert profiled(busy_handler)({}, None) == {'statusCode': 200}
+        assert 'Profiling test_profiling.busy_handler failed' in capsys.readouterr().out
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
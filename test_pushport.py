@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+pytest tests for pushport.py live boards
+
+Run with: pytest test_pushport.py -v
+"""
+
+import json
+import socket
+import threading
+import urllib.error
+import pytest
+import trains
+from pushport import (BoardIndex, FileSource, SocketSource, consume, prune_before,
+                      start_consumer, PRUNE_INTERVAL_SECONDS)
+
+PPORT = ('<Pport xmlns="http://www.thalesgroup.com/rtti/PushPort/v16" '
+         'xmlns:ns2="http://www.thalesgroup.com/rtti/PushPort/Schedules/v3" '
+         'xmlns:ns5="http://www.thalesgroup.com/rtti/PushPort/Forecasts/v3" '
+         'ts="2026-03-05T14:30:00" version="16.0"><uR updateOrigin="Darwin">{}</uR></Pport>')
+
+SCHEDULE_1438 = PPORT.format(
+    '<ns2:schedule rid="202603058839" uid="W88392" trainId="2A38" ssd="2026-03-05" toc="SW">'
+    '<ns2:OR tpl="ALTON" act="TB" ptd="13:32" wtd="13:32"/>'
+    '<ns2:PP tpl="WOKINGJ" wtp="14:12"/>'
+    '<ns2:IP tpl="SURBITN" act="T " pta="14:37" ptd="14:38" wta="14:37" wtd="14:38"/>'
+    '<ns2:IP tpl="CLPHMJC" act="T " pta="14:50" ptd="14:51" wta="14:50" wtd="14:51"/>'
+    '<ns2:DT tpl="WATRLMN" act="TF" pta="14:58" wta="14:58"/>'
+    '</ns2:schedule>')
+
+SCHEDULE_1448 = PPORT.format(
+    '<ns2:schedule rid="202603058840" uid="W88400" trainId="2H48" ssd="2026-03-05" toc="SW">'
+    '<ns2:OR tpl="SURBITN" act="TB" ptd="14:48" wtd="14:48"/>'
+    '<ns2:OPIP tpl="SURBCSD" wta="14:50" wtd="14:51"/>'
+    '<ns2:DT tpl="WATRLMN" act="TF" pta="15:06" wta="15:06"/>'
+    '</ns2:schedule>')
+
+FORECAST_DELAY = PPORT.format(
+    '<TS rid="202603058839" uid="W88392" ssd="2026-03-05">'
+    '<ns5:Location tpl="SURBITN" wta="14:37" wtd="14:38" pta="14:37" ptd="14:38">'
+    '<ns5:arr et="14:43" src="Darwin"/><ns5:dep et="14:44" delayed="false" src="Darwin"/>'
+    '</ns5:Location></TS>')
+
+CANCEL_1448 = SCHEDULE_1448.replace('tpl="SURBITN" act="TB"', 'tpl="SURBITN" can="true" act="TB"')
+
+DEACTIVATE_1438 = PPORT.format('<deactivated rid="202603058839"/>')
+
+
+@pytest.fixture
+def index():
+    index = BoardIndex(tiploc_lookup={'SURBITN': 'SUR', 'CLPHMJC': 'CLJ', 'WATRLMN': 'WAT'}.get)
+    index.apply(SCHEDULE_1438)
+    index.apply(SCHEDULE_1448)
+    return index
+
+
+class TestBoards:
+    """Boards built from schedules and forecasts"""
+
+    def test_board_matches_darwin_schema(self, index):
+        first, second = index.board('sur', 'wat', now=14 * 60 + 30)
+        assert first.to_dict() == {
+            'scheduledDeparture': '1438', 'expectedDeparture': '1438',
+            'arrivalTime': '1458', 'eta': '1458', 'journeyMins': 20, 'stops': 1,
+            'delayMinutes': 0, 'cancelled': False, 'status': 'On time'}
+        # Operational and passing points don't count as stops
+        assert second['stops'] == 0
+        assert second['journeyMins'] == 18
+
+    def test_forecast_delay(self, index):
+        index.apply(FORECAST_DELAY)
+        first = index.board('sur', 'wat', now=14 * 60 + 30)[0]
+        assert first['delayMinutes'] == 6
+        assert first['expectedDeparture'] == '1444'
+        assert first['status'] == '14:44'
+        assert first['eta'] == '1504'
+
+    def test_cancellation_and_deactivation(self, index):
+        index.apply(CANCEL_1448)
+        index.apply(DEACTIVATE_1438)
+        [only] = index.board('sur', 'wat', now=14 * 60 + 30)
+        assert only['cancelled'] is True
+        assert only['status'] == 'Cancelled'
+        assert len(index) == 1
+
+    def test_direction_and_window(self, index):
+        assert index.board('wat', 'sur', now=14 * 60 + 30) == []
+        assert index.board('sur', 'clj', now=14 * 60 + 30)[0]['stops'] == 0
+        # Both trains have gone by 15:00
+        assert index.board('sur', 'wat', now=15 * 60) == []
+
+    def test_board_cached_until_origin_changes(self, index):
+        board = index.board('sur', 'wat', now=870)
+        assert index.board('sur', 'wat', now=870) is board
+        index.apply(FORECAST_DELAY)
+        assert index.board('sur', 'wat', now=870) is not board
+
+    def test_prune(self, index):
+        assert index.prune('2026-03-06') == 2
+        assert index.board('sur', 'wat', now=870) == []
+
+
+class TestSources:
+    """Replay sources feed the same pipeline"""
+
+    def test_file_replay(self, tmp_path):
+        replay = tmp_path / 'pushport.log'
+        replay.write_text('\n'.join([SCHEDULE_1438, 'not xml', FORECAST_DELAY, '']))
+        index = BoardIndex(tiploc_lookup={'SURBITN': 'SUR', 'WATRLMN': 'WAT'}.get)
+        assert consume(index, FileSource(str(replay))) == 2
+        assert index.board('sur', 'wat', now=870)[0]['delayMinutes'] == 6
+
+    def test_file_follow_picks_up_appended_messages(self, tmp_path):
+        replay = tmp_path / 'pushport.log'
+        replay.write_text(SCHEDULE_1438 + '\n')
+        messages = iter(FileSource(str(replay), follow=True, poll_seconds=0.01))
+        assert next(messages) == SCHEDULE_1438
+        with open(replay, 'a') as f:
+            f.write(SCHEDULE_1448[:40])
+            f.flush()
+            threading.Timer(0.05, lambda: (f.write(SCHEDULE_1448[40:] + '\n'), f.flush())).start()
+            assert next(messages) == SCHEDULE_1448
+
+    def test_consume_prunes_earlier_days(self):
+        index = BoardIndex(tiploc_lookup={'SURBITN': 'SUR', 'WATRLMN': 'WAT'}.get)
+        # 2026-03-06 05:00 London: the 2026-03-05 service is a day old
+        now = 1772773200
+        times = iter([now - PRUNE_INTERVAL_SECONDS, now - 1, now])
+        consume(index, [SCHEDULE_1438, SCHEDULE_1448], clock=lambda: next(times))
+        assert len(index) == 0
+
+    def test_late_night_service_kept_after_midnight(self):
+        # 2026-03-06 01:00 London: still within the previous service day
+        assert prune_before(1772758800) == '2026-03-05'
+        assert prune_before(1772773200) == '2026-03-06'
+
+    def test_socket_replay(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+
+        def serve():
+            conn, _ = server.accept()
+            with conn:
+                conn.sendall((SCHEDULE_1448 + '\n' + CANCEL_1448 + '\n').encode())
+            server.close()
+        threading.Thread(target=serve, daemon=True).start()
+
+        index = BoardIndex(tiploc_lookup={'SURBITN': 'SUR', 'WATRLMN': 'WAT'}.get)
+        source = SocketSource(*server.getsockname(), timeout=5)
+        assert consume(index, source) == 2
+        assert index.board('sur', 'wat', now=870)[0]['cancelled'] is True
+
+
+class TestTrainsHandler:
+    """/trains answered from memory when a live index covers the origin"""
+
+    def test_handler_uses_live_boards(self, index, monkeypatch):
+        def no_soap(*args, **kwargs):
+            raise AssertionError('SOAP should not be called')
+        monkeypatch.setattr(trains, 'soap_request', no_soap)
+        monkeypatch.setattr(trains, 'get_darwin_api_key', lambda deadline=None: None)
+        monkeypatch.setattr(trains, 'live_boards', index)
+        response = trains.lambda_handler({}, None)
+        assert response['statusCode'] == 200
+        assert json.loads(response['body'])['fresh'] is True
+
+    def test_silent_feed_falls_back_to_soap(self, index, monkeypatch):
+        calls = []
+
+        def soap(*args, **kwargs):
+            calls.append(args)
+            raise urllib.error.URLError('Darwin down')
+        monkeypatch.setattr(trains, 'soap_request', soap)
+        monkeypatch.setattr(trains, 'get_darwin_api_key', lambda deadline=None: 'key')
+        monkeypatch.setattr(trains, '_last_boards', {})
+        monkeypatch.setattr(trains, 'live_boards', index)
+        index.last_message_at -= 600
+        assert not index.live()
+        response = trains.lambda_handler({}, None)
+        assert response['statusCode'] == 500
+        assert 'Darwin down' in json.loads(response['body'])['error']
+        assert len(calls) == 1
+
+
+class FlakySource:
+    """Drops the connection once, then delivers and ends cleanly."""
+
+    def __init__(self):
+        self.connects = 0
+
+    def __iter__(self):
+        self.connects += 1
+        yield SCHEDULE_1438
+        if self.connects == 1:
+            raise ConnectionResetError('feed dropped')
+
+
+class TestConsumerThread:
+    """The consumer reconnects and stops serving boards when it exits"""
+
+    def test_reconnects_then_clears_live_boards(self, monkeypatch):
+        monkeypatch.setattr(trains, 'live_boards', None)
+        source = FlakySource()
+        index = BoardIndex(tiploc_lookup={'SURBITN': 'SUR', 'WATRLMN': 'WAT'}.get)
+        index, thread, stop_event = start_consumer(source, index, reconnect_seconds=0)
+        thread.join(timeout=5)
+        assert source.connects == 2
+        assert index.messages == 2
+        assert trains.live_boards is None
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+pytest tests for records.py compact departures/arrivals
+
+Run with: pytest test_records.py -v
+"""
+
+import io
+import json
+import pytest
+from records import (Departure, Arrival, hhmm_minutes, format_hhmm,
+                     parse_arrivals, write_departures)
+from trains import parse_darwin_response
+from test_trains import MOCK_RESPONSE_WITH_DELAY, MOCK_RESPONSE_CANCELLED
+
+
+TFL_ARRIVALS = json.dumps([
+    {'$type': 'Tfl.Api.Presentation.Entities.Prediction', 'naptanId': '490010781S',
+     'lineName': 'K2', 'timeToStation': 412,
+     'timing': {'$type': 'Tfl.Api.Presentation.Entities.PredictionTiming', 'countdownServerAdjustment': '00:00:00'}},
+    {'naptanId': '490010781S', 'lineName': 'K3', 'timeToStation': 95,
+     'timing': {'countdownServerAdjustment': '00:00:01'}},
+])
+
+
+class TestTimes:
+    """Tests for minutes-since-midnight storage"""
+
+    def test_round_trip(self):
+        assert hhmm_minutes('14:38') == 878
+        assert format_hhmm(878) == '1438'
+        assert format_hhmm(1440 + 5) == '0005'
+
+    def test_non_times_kept_as_strings(self):
+        assert hhmm_minutes('') == ''
+        assert hhmm_minutes(None) == ''
+        assert hhmm_minutes('Delayed') == 'Delayed'
+        assert format_hhmm('') == ''
+
+
+class TestDeparture:
+    """Departures stay compatible with the old per-service dicts"""
+
+    def test_indexing_by_json_key(self):
+        [dep] = parse_darwin_response(MOCK_RESPONSE_WITH_DELAY, destination_crs='WAT')
+        assert isinstance(dep, Departure)
+        assert dep['expectedDeparture'] == '1008'
+        assert dep.get('eta') == dep['eta']
+        assert dep.get('missing', 'x') == 'x'
+        assert 'stops' in dep
+
+    def test_write_json_matches_json_dumps(self):
+        for xml in (MOCK_RESPONSE_WITH_DELAY, MOCK_RESPONSE_CANCELLED):
+            departures = parse_darwin_response(xml, destination_crs='WAT')
+            out = io.StringIO()
+            write_departures(departures, out.write)
+            assert out.getvalue() == json.dumps([d.to_dict() for d in departures])
+
+    def test_plain_dicts_still_serialise(self):
+        out = io.StringIO()
+        write_departures([{'scheduledDeparture': '1438'}], out.write)
+        assert json.loads(out.getvalue()) == [{'scheduledDeparture': '1438'}]
+
+    def test_slots_only(self):
+        dep = Departure(878, 878, 898, 898, 20, 1, 0, False, 'On time')
+        assert not hasattr(dep, '__dict__')
+        assert dep == dep.to_dict()
+
+
+class TestArrivals:
+    """TfL predictions decode straight into Arrival records"""
+
+    def test_parse_arrivals(self):
+        arrivals = parse_arrivals(TFL_ARRIVALS)
+        assert arrivals == [Arrival('490010781S', 'K2', 412), Arrival('490010781S', 'K3', 95)]
+        assert not hasattr(arrivals[0], '__dict__')
+
+    def test_empty_response(self):
+        assert parse_arrivals('[]') == []
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+pytest tests for server.py shared-memory cache and pre-fork serving
+
+Run with: pytest test_server.py -v
+"""
+
+import gzip
+import json
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+import urllib.request
+import pytest
+import trains
+import server
+from server import SharedCache, WorkerHandler, cache_key, run_refresher, serve, SLOT_HEADER
+
+ctx = multiprocessing.get_context('fork')
+
+
+@pytest.fixture
+def cache():
+    cache = SharedCache.create(slots=4, body_bytes=64)
+    yield cache
+    cache.close()
+    cache.unlink()
+
+
+class TestSharedCache:
+    """Tests for the fixed-layout table and its seqlock"""
+
+    def test_put_get_overwrite(self, cache):
+        assert cache.get('t3?stop=parklands') is None
+        assert cache.put('t3?stop=parklands', 200, b'{"seconds": [60]}', now=5.0)
+        assert cache.get('t3?stop=parklands') == (200, b'{"seconds": [60]}', 5.0)
+        cache.put('t3?stop=parklands', 200, b'{}', now=6.0)
+        assert cache.get('t3?stop=parklands') == (200, b'{}', 6.0)
+
+    def test_collisions_and_capacity(self, cache):
+        keys = [f'k{i}' for i in range(4)]
+        for i, key in enumerate(keys):
+            assert cache.put(key, 200, str(i).encode())
+        assert [cache.get(k)[1] for k in keys] == [b'0', b'1', b'2', b'3']
+        assert not cache.put('one-too-many', 200, b'x')
+        assert cache.get('one-too-many') is None
+
+    def test_deleted_slots_reused_without_breaking_probes(self, cache):
+        keys = [f'k{i}' for i in range(4)]
+        for key in keys:
+            cache.put(key, 200, key.encode())
+        assert cache.delete('k1')
+        assert not cache.delete('k1')
+        assert cache.get('k1') is None
+        assert [cache.get(k)[1] for k in ('k0', 'k2', 'k3')] == [b'k0', b'k2', b'k3']
+        assert cache.put('t3?stop=parklands', 200, b'{}')
+        assert cache.get('t3?stop=parklands')[1] == b'{}'
+        assert [cache.get(k)[1] for k in ('k0', 'k2', 'k3')] == [b'k0', b'k2', b'k3']
+
+    def test_oversized_body_rejected(self, cache):
+        assert not cache.put('big', 200, b'x' * 65)
+
+    def test_torn_slot_treated_as_miss(self, cache):
+        cache.put('k', 200, b'body')
+        slot = cache._writer_slots[b'k']
+        offset = cache._slot_offset(slot)
+        seq = SLOT_HEADER.unpack_from(cache.buf, offset)[0]
+        struct.pack_into('<Q', cache.buf, offset, seq + 1)   # writer mid-update
+        assert cache.get('k') is None
+        struct.pack_into('<Q', cache.buf, offset, seq + 2)
+        assert cache.get('k')[1] == b'body'
+
+    def test_visible_across_processes(self, cache):
+        def write():
+            cache.put('trains?from=sur&to=wat', 200, b'{"departures": []}')
+        child = ctx.Process(target=write)
+        child.start()
+        child.join()
+        assert cache.get('trains?from=sur&to=wat')[1] == b'{"departures": []}'
+        reader = SharedCache.attach(cache.name)
+        assert reader.get('trains?from=sur&to=wat')[0] == 200
+        reader.close()
+
+
+class TestCacheKeys:
+    def test_normalised(self):
+        assert cache_key('/t3', {}) == 't3?stop=parklands'
+        assert cache_key('/', {'stop': 'Surbiton'}) == 't3?stop=surbiton'
+        assert cache_key('/trains/', {'from': 'WAT', 'to': 'sur'}) == 'trains?from=wat&to=sur'
+        assert cache_key('/elsewhere', {}) is None
+
+    def test_values_cannot_inject_parameters(self):
+        key = cache_key('/trains', {'from': 'sur&to=clj'})
+        assert key == 'trains?from=sur%26to%3Dclj&to=wat'
+        assert server.parse_qs(key.partition('?')[2]) == {'from': ['sur&to=clj'], 'to': ['wat']}
+
+    def test_long_key_rejected_with_reason(self, cache, capsys):
+        assert not cache.put('k' * (server.KEY_BYTES + 1), 200, b'{}')
+        assert 'key is longer than' in capsys.readouterr().out
+
+    def test_unknown_stops_resolve_to_parklands(self):
+        assert cache_key('/t3', {'stop': 'junk1'}) == 't3?stop=parklands'
+        assert cache_key('/t3', {'stop': 'junk2,surbiton'}) == 't3?stop=parklands,surbiton'
+
+
+class TestRefresher:
+    """Client-chosen keys can't fill the table for good"""
+
+    def test_least_recently_demanded_key_evicted(self, cache):
+        demand = queue.Queue()
+        stop_event = threading.Event()
+        for i in range(10):
+            demand.put(f'trains?from=junk{i}&to=wat')
+        demand.put('t3?stop=parklands')
+
+        def render(key):
+            if key == 't3?stop=parklands':
+                stop_event.set()
+            return 200, b'{}'
+        thread = threading.Thread(target=run_refresher, args=(cache, demand, stop_event, render, ()),
+                                  kwargs={'interval': 60})
+        thread.start()
+        thread.join(10)
+        assert cache.get('t3?stop=parklands')[1] == b'{}'
+        assert cache.get('trains?from=junk0&to=wat') is None
+
+
+class TestWorker:
+    def test_ping_record_bounded(self, cache, monkeypatch):
+        monkeypatch.setattr(server, 'MISS_WAIT_SECONDS', 0)
+        demand = queue.Queue()
+        handler_class = type('Handler', (WorkerHandler,), {
+            'cache': cache, 'demand': demand, 'pinged': server.OrderedDict(),
+            'pinged_lock': threading.Lock()})
+        handler = handler_class.__new__(handler_class)
+        for i in range(1000):
+            assert handler._lookup(f'trains?from=junk{i}&to=wat') is None
+        assert len(handler.pinged) == server.MAX_PINGED_KEYS
+        assert demand.qsize() == 1000
+
+
+class TestPreFork:
+    """Many workers, one refresher: upstream work doesn't grow with workers"""
+
+    def test_workers_share_one_refresher(self):
+        renders = ctx.Value('i', 0)
+        body = json.dumps({'departures': [{'status': 'On time'}] * 100}).encode()
+
+        def render(key):
+            with renders.get_lock():
+                renders.value += 1
+            return 200, body
+
+        started = threading.Event()
+        stop_event = ctx.Event()
+        address = []
+
+        def ready(addr):
+            address.append(addr)
+            started.set()
+        thread = threading.Thread(target=serve, kwargs=dict(
+            host='127.0.0.1', port=0, workers=3, render=render,
+            keys=('trains?from=sur&to=wat',), ready=ready, stop_event=stop_event))
+        thread.start()
+        try:
+            assert started.wait(10)
+            base = f'http://127.0.0.1:{address[0][1]}'
+            for _ in range(30):
+                with urllib.request.urlopen(f'{base}/trains?from=sur&to=wat', timeout=10) as r:
+                    assert r.read() == body
+            # A new key is rendered once on demand, then served from memory
+            for _ in range(10):
+                with urllib.request.urlopen(f'{base}/t3?stop=surbiton', timeout=10) as r:
+                    assert r.status == 200
+            request = urllib.request.Request(f'{base}/trains', headers={'Accept-Encoding': 'gzip'})
+            with urllib.request.urlopen(request, timeout=10) as r:
+                assert r.headers['Content-Encoding'] == 'gzip'
+                assert gzip.decompress(r.read()) == body
+            assert renders.value == 2
+        finally:
+            stop_event.set()
+            thread.join(10)
+
+    def test_miss_does_not_block_worker(self):
+        def render(key):
+            if 'slow' in key:
+                time.sleep(2)
+            return 200, b'{}'
+
+        started = threading.Event()
+        stop_event = ctx.Event()
+        address = []
+
+        def ready(addr):
+            address.append(addr)
+            started.set()
+        thread = threading.Thread(target=serve, kwargs=dict(
+            host='127.0.0.1', port=0, workers=1, render=render,
+            keys=('trains?from=sur&to=wat',), ready=ready, stop_event=stop_event))
+        thread.start()
+        try:
+            assert started.wait(10)
+            base = f'http://127.0.0.1:{address[0][1]}'
+            urllib.request.urlopen(f'{base}/trains', timeout=10).read()
+            miss = threading.Thread(
+                target=lambda: urllib.request.urlopen(f'{base}/trains?from=slow', timeout=10).read())
+            miss.start()
+            time.sleep(0.2)  # the miss is now waiting inside the only worker
+            began = time.time()
+            urllib.request.urlopen(f'{base}/trains', timeout=10).read()
+            assert time.time() - began < 1
+            miss.join(10)
+        finally:
+            stop_event.set()
+            thread.join(10)
+
+
+    def test_trains_served_from_pushport_feed(self, tmp_path, monkeypatch):
+        from test_pushport import SCHEDULE_1438
+
+        def no_soap(*args, **kwargs):
+            raise AssertionError('SOAP should not be called')
+        # Forked processes inherit these
+        monkeypatch.setattr(trains, 'soap_request', no_soap)
+        monkeypatch.setattr(trains, 'get_darwin_api_key', lambda deadline=None: None)
+        feed = tmp_path / 'pushport.log'
+        feed.write_text(SCHEDULE_1438 + '\n')
+
+        from pushport import FileSource
+        started = threading.Event()
+        stop_event = ctx.Event()
+        address = []
+
+        def ready(addr):
+            address.append(addr)
+            started.set()
+        thread = threading.Thread(target=serve, kwargs=dict(
+            host='127.0.0.1', port=0, workers=1, keys=(), ready=ready, stop_event=stop_event,
+            feed=FileSource(str(feed), follow=True, poll_seconds=0.05)))
+        thread.start()
+        try:
+            assert started.wait(10)
+            time.sleep(0.5)  # let the refresher's consumer apply the feed
+            url = f'http://127.0.0.1:{address[0][1]}/trains?from=sur&to=wat'
+            with urllib.request.urlopen(url, timeout=10) as r:
+                body = json.loads(r.read())
+            assert body['fresh'] is True
+            assert body['originName'] == 'Surbiton'
+        finally:
+            stop_event.set()
+            thread.join(10)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
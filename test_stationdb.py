@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+pytest tests for stationdb.py memory-mapped lookups
+
+Run with: pytest test_stationdb.py -v
+"""
+
+import pytest
+import stationdb
+import trains
+import t3
+
+
+STATIONS_CSV = '''AtcoCode,TiplocCode,CrsCode,StationName
+9100SURBITN,SURBITN,SUR,Surbiton Rail Station
+9100WATRLMN,WATRLMN,WAT,London Waterloo Rail Station
+9100CLPHMJC,CLPHMJC,CLJ,Clapham Junction Rail Station
+9100BRKWOOD,BRKWOOD,BKO,Brookwood Rail Station
+'''
+
+STOPS_CSV = '''ATCOCode,CommonName,Indicator,LocalityName
+490010781S,Parklands,Stop P,Surbiton
+490000077B,Kingston Hospital,Stop KH,Kingston
+'''
+
+
+@pytest.fixture
+def stations_db(tmp_path):
+    csv_path = tmp_path / 'RailReferences.csv'
+    csv_path.write_text(STATIONS_CSV)
+    db_path = str(tmp_path / 'stations.db')
+    stationdb.build(stationdb.station_records(str(csv_path)), db_path)
+    db = stationdb.StationDB(db_path)
+    yield db
+    db.close()
+
+
+class TestLookup:
+    """Tests for building and binary-searching the database"""
+
+    def test_lookup_every_key(self, stations_db):
+        assert len(stations_db) == 4
+        assert stations_db.get('SUR') == ('Surbiton',)
+        assert stations_db.get('BKO') == ('Brookwood',)
+        assert stations_db.get('CLJ') == ('Clapham Junction',)
+        assert stations_db.get('WAT') == ('London Waterloo',)
+
+    def test_lookup_is_case_insensitive(self, stations_db):
+        assert stations_db.get('wat') == ('London Waterloo',)
+        assert 'clj' in stations_db
+
+    def test_missing_key(self, stations_db):
+        assert stations_db.get('ZZZ') is None
+        assert stations_db.get('AAA', 'fallback') == 'fallback'
+        assert 'XYZ' not in stations_db
+
+    def test_mismatched_field_count_rejected(self, tmp_path):
+        with pytest.raises(ValueError):
+            stationdb.build([('A', ('x',)), ('B', ('x', 'y'))], str(tmp_path / 'bad.db'))
+
+    def test_bad_file_rejected(self, tmp_path):
+        path = tmp_path / 'junk.db'
+        path.write_bytes(b'not a database at all')
+        assert stationdb.open_db(str(path)) is None
+
+    def test_missing_file(self, tmp_path):
+        assert stationdb.open_db(str(tmp_path / 'absent.db')) is None
+
+
+class TestHandlerIntegration:
+    """Tests for the trains.py / t3.py fallbacks to the database"""
+
+    def test_station_name_from_db(self, stations_db, monkeypatch):
+        monkeypatch.setattr(trains, 'STATION_DB_PATH', stations_db.path)
+        assert trains.station_name('clj') == 'Clapham Junction'
+        assert trains.station_name('sur') == 'Surbiton'
+        assert trains.station_name('zzz') == 'ZZZ'
+
+    def test_station_name_without_db(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(trains, 'STATION_DB_PATH', str(tmp_path / 'absent.db'))
+        assert trains.station_name('clj') == 'CLJ'
+
+    def test_stop_config_from_db(self, tmp_path, monkeypatch):
+        csv_path = tmp_path / 'Stops.csv'
+        csv_path.write_text(STOPS_CSV)
+        db_path = str(tmp_path / 'stops.db')
+        stationdb.build(stationdb.stop_records(str(csv_path)), db_path)
+        monkeypatch.setattr(t3, 'STOP_DB_PATH', db_path)
+
+        config = t3.get_stop_config('490000077b')
+        assert config == {'naptan_id': '490000077B', 'name': 'Kingston Hospital',
+                          'destination': 'Kingston'}
+        assert t3.get_stop_config('surbiton') is t3.STOPS['surbiton']
+        assert t3.get_stop_config('unknown') is t3.STOPS['parklands']
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
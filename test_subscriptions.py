@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+pytest tests for subscriptions.py fan-out and reference counting
+
+Run with: pytest test_subscriptions.py -v
+"""
+
+import pytest
+from subscriptions import (SubscriptionRegistry, MemoryStore, Refresher,
+                           bus_interest, train_interest)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeUpstream:
+    """Counts calls and returns canned per-route seconds / departures."""
+
+    def __init__(self):
+        self.bus_calls = []
+        self.train_calls = []
+        self.fail = False
+
+    def fetch_bus(self, naptan_id):
+        self.bus_calls.append(naptan_id)
+        if self.fail:
+            return None, 'TfL down'
+        return {'K2': [60, 300], 'K3': [120]}, None
+
+    def fetch_train(self, origin, destination):
+        self.train_calls.append((origin, destination))
+        return [{'scheduledDeparture': '1438'}], None
+
+
+@pytest.fixture
+def setup():
+    registry = SubscriptionRegistry(MemoryStore())
+    upstream = FakeUpstream()
+    clock = FakeClock()
+    refresher = Refresher(registry, upstream.fetch_bus, upstream.fetch_train,
+                          interval=30, clock=clock)
+    return registry, upstream, clock, refresher
+
+
+class TestDeduplication:
+    """Upstream calls scale with distinct keys, not users"""
+
+    def test_many_users_one_stop(self, setup):
+        registry, upstream, clock, refresher = setup
+        for i in range(500):
+            registry.subscribe(f'user{i}', bus_interest('490010781S', 'K2'))
+        assert registry.upstream_keys() == {('bus', '490010781S'): 500}
+        assert refresher.refresh() == 1
+        assert upstream.bus_calls == ['490010781S']
+
+    def test_routes_at_same_stop_share_fetch(self, setup):
+        registry, upstream, clock, refresher = setup
+        registry.subscribe('alice', bus_interest('490010781s', 'k2'))
+        registry.subscribe('bob', bus_interest('490010781S', 'K3'))
+        refresher.refresh()
+        assert len(upstream.bus_calls) == 1
+        assert registry.view('alice')[bus_interest('490010781S', 'K2')]['data'] == [60, 300]
+        assert registry.view('bob')[bus_interest('490010781S', 'K3')]['data'] == [120]
+
+    def test_train_pairs_deduplicated(self, setup):
+        registry, upstream, clock, refresher = setup
+        registry.subscribe('alice', train_interest('sur', 'wat'))
+        registry.subscribe('bob', train_interest('SUR', 'WAT'))
+        registry.subscribe('bob', train_interest('wat', 'sur'))
+        assert refresher.refresh() == 2
+        assert sorted(upstream.train_calls) == [('SUR', 'WAT'), ('WAT', 'SUR')]
+
+
+class TestLineFetch:
+    """Many stops in demand are served from one line-wide call"""
+
+    def test_switches_to_line_fetch(self, setup):
+        registry, upstream, clock, refresher = setup
+        line_calls = []
+
+        def fetch_lines(routes):
+            line_calls.append(routes)
+            return {'STOP1': {'K2': [60]}, 'STOP2': {'K1': [90]}}, None
+        refresher.fetch_lines = fetch_lines
+        registry.subscribe('alice', bus_interest('stop1', 'K2'))
+        registry.subscribe('bob', bus_interest('stop2', 'K1'))
+        registry.subscribe('carol', bus_interest('stop3', 'K2'))
+        registry.subscribe('carol', train_interest('sur', 'wat'))
+
+        assert refresher.refresh() == 2   # one line call, one train call
+        assert line_calls == [['K1', 'K2']]
+        assert upstream.bus_calls == []
+        assert registry.view('alice')[bus_interest('stop1', 'K2')]['data'] == [60]
+        assert registry.view('carol')[bus_interest('stop3', 'K2')]['data'] == []
+        assert refresher.refresh() == 0
+
+    def test_few_stops_fetched_per_stop(self, setup):
+        registry, upstream, clock, refresher = setup
+        refresher.fetch_lines = lambda routes: pytest.fail('line fetch not expected')
+        registry.subscribe('alice', bus_interest('stop1', 'K2'))
+        registry.subscribe('bob', bus_interest('stop2', 'K2'))
+        assert refresher.refresh() == 2
+
+
+class TestRefreshInterval:
+    """Each key is fetched at most once per interval"""
+
+    def test_fresh_keys_skipped(self, setup):
+        registry, upstream, clock, refresher = setup
+        registry.subscribe('alice', bus_interest('490010781S', 'K2'))
+        refresher.refresh()
+        clock.now += 10
+        assert refresher.refresh() == 0
+        clock.now += 25
+        assert refresher.refresh() == 1
+
+    def test_error_keeps_last_good_data(self, setup):
+        registry, upstream, clock, refresher = setup
+        interest = bus_interest('490010781S', 'K2')
+        registry.subscribe('alice', interest)
+        refresher.refresh()
+        upstream.fail = True
+        clock.now += 60
+        refresher.refresh()
+        result = registry.view('alice')[interest]
+        assert result['data'] == [60, 300]
+        assert result['error'] == 'TfL down'
+
+
+class TestReferenceCounting:
+    """Keys disappear when their last subscriber leaves"""
+
+    def test_unsubscribe_drops_key_and_result(self, setup):
+        registry, upstream, clock, refresher = setup
+        interest = bus_interest('490010781S', 'K2')
+        registry.subscribe('alice', interest)
+        registry.subscribe('bob', interest)
+        refresher.refresh()
+        registry.unsubscribe('alice')
+        assert registry.upstream_keys() == {('bus', '490010781S'): 1}
+        registry.unsubscribe('bob', interest)
+        assert registry.upstream_keys() == {}
+        assert registry.store.results == {}
+        assert registry.view('bob') == {}
+
+    def test_unsubscribe_during_fetch_not_resurrected(self, setup):
+        registry, upstream, clock, refresher = setup
+        interest = train_interest('sur', 'wat')
+        registry.subscribe('alice', interest)
+
+        def fetch_train(origin, destination):
+            registry.unsubscribe('alice')  # last subscriber leaves mid-fetch
+            return [{'scheduledDeparture': '1438'}], None
+
+        refresher.fetch_train = fetch_train
+        assert refresher.refresh() == 1
+        assert registry.store.results == {}
+        assert not registry.publish(('train', 'SUR', 'WAT'), [], None, clock.now)
+
+    def test_duplicate_subscribe_not_double_counted(self, setup):
+        registry, upstream, clock, refresher = setup
+        assert registry.subscribe('alice', train_interest('sur', 'wat'))
+        assert not registry.subscribe('alice', train_interest('sur', 'wat'))
+        assert registry.upstream_keys() == {('train', 'SUR', 'WAT'): 1}
+
+    def test_registry_rebuilds_counts_from_store(self, setup):
+        registry, upstream, clock, refresher = setup
+        registry.subscribe('alice', bus_interest('490010781S', 'K2'))
+        registry.subscribe('bob', bus_interest('490010781S', 'K3'))
+        reopened = SubscriptionRegistry(registry.store)
+        assert reopened.upstream_keys() == {('bus', '490010781S'): 2}
+
+    def test_view_before_first_refresh(self, setup):
+        registry, upstream, clock, refresher = setup
+        interest = train_interest('sur', 'wat')
+        registry.subscribe('alice', interest)
+        assert registry.view('alice') == {interest: None}
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
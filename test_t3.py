@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+pytest tests for t3.py per-stop vs per-line arrivals fetching
+
+Run with: pytest test_t3.py -v
+"""
+
+import pytest
+import t3
+from records import Arrival
+
+LINE_ARRIVALS = [
+    Arrival('490010781S', 'K2', 300),
+    Arrival('490010781S', 'K2', 60),
+    Arrival('490015165B', 'K2', 500),
+    Arrival('490000077B', 'K2', 45),
+]
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = {'stop': [], 'line': []}
+
+    def fetch_stop(naptan_id, api_key=None, deadline=None):
+        calls['stop'].append(naptan_id)
+        return [a for a in LINE_ARRIVALS if a.naptan_id == naptan_id]
+
+    def fetch_line(line_ids, api_key=None, deadline=None):
+        calls['line'].append(tuple(line_ids))
+        return list(LINE_ARRIVALS)
+
+    monkeypatch.setattr(t3, 'fetch_arrivals_from_naptan', fetch_stop)
+    monkeypatch.setattr(t3, 'fetch_line_arrivals', fetch_line)
+    monkeypatch.setattr(t3, '_stop_demand', {})
+    monkeypatch.setattr(t3, '_line_index', {})
+    return calls
+
+
+class TestFetchPolicy:
+    """Per-stop until enough distinct stops are in demand"""
+
+    def test_few_stops_fetched_individually(self, upstream):
+        assert [a.seconds for a in t3.arrivals_for_naptan('490010781S')] == [300, 60]
+        t3.arrivals_for_naptan('490015165B')
+        assert upstream['stop'] == ['490010781S', '490015165B']
+        assert upstream['line'] == []
+
+    def test_line_fetch_serves_every_stop(self, upstream):
+        for naptan_id in ('490010781S', '490015165B', '490000077B'):
+            t3.arrivals_for_naptan(naptan_id)
+        t3.arrivals_for_naptan('490010781S')
+        t3.arrivals_for_naptan('490099999X')
+        assert upstream['stop'] == ['490010781S', '490015165B']
+        assert upstream['line'] == [('K2',)]
+        assert t3.arrivals_for_naptan('490000077B') == [Arrival('490000077B', 'K2', 45)]
+        assert t3.arrivals_for_naptan('490099999X') == []
+
+    def test_line_index_refreshed_and_aged(self, upstream, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(t3.time, 'time', lambda: now[0])
+        for naptan_id in ('490010781S', '490015165B', '490000077B'):
+            t3.arrivals_for_naptan(naptan_id)
+        now[0] += 10
+        assert t3.arrivals_for_naptan('490000077B') == [Arrival('490000077B', 'K2', 35)]
+        now[0] += t3.LINE_REFRESH_SECONDS
+        t3.arrivals_for_naptan('490000077B')
+        assert len(upstream['line']) == 2
+
+    def test_demand_expires(self, upstream, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(t3.time, 'time', lambda: now[0])
+        t3.arrivals_for_naptan('490010781S')
+        t3.arrivals_for_naptan('490015165B')
+        now[0] += t3.DEMAND_WINDOW_SECONDS + 1
+        t3.arrivals_for_naptan('490000077B')
+        assert upstream['line'] == []
+        assert t3.stops_in_demand() == {'490000077B'}
+
+    def test_handler_result_unchanged(self, upstream):
+        result, error = t3.fetch_arrivals_for_stop('parklands')
+        assert error is None
+        assert result == {'stop': 'Parklands', 'destination': 'Surbiton', 'seconds': [60, 300]}
+
+
+class TestLineIndex:
+    def test_index_by_stop(self):
+        stops = t3.index_by_stop(LINE_ARRIVALS)
+        assert set(stops) == {'490010781S', '490015165B', '490000077B'}
+        assert len(stops['490010781S']) == 2
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -141,6 +141,15 @@ class TestJSONFormatting:
         assert data['originName'] == 'Surbiton'
         assert data['destinationName'] == 'London Waterloo'
 
+    def test_empty_etd_writes_null_status(self):
+        """An empty <etd/> should not break the response"""
+        response = MOCK_RESPONSE_SUR_TO_WAT.replace('<lt4:etd>On time</lt4:etd>', '<lt4:etd/>')
+        departures = parse_darwin_response(response, destination_crs='WAT')
+        data = json.loads(format_json(departures, 'sur', 'wat'))
+
+        assert data['departures'][0]['status'] is None
+        assert data['departures'][0]['scheduledDeparture'] == '1438'
+
 
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
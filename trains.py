@@ -6,10 +6,20 @@ Uses the official National Rail Darwin OpenLDBWS SOAP API.
 Requires API key from: https://realtime.nationalrail.co.uk/OpenLDBWSRegistration/
 """
 
+import io
 import json
+import os
+import time
 import urllib.request
 import xml.etree.ElementTree as ET
 from datetime import datetime, timezone
+from json.encoder import encode_basestring_ascii
+
+import stationdb
+from compression import cached_body, compress_response
+from deadline import Deadline, upstream_timeout
+from profiling import profiled
+from records import Departure, hhmm_minutes, write_departures
 
 DARWIN_ENDPOINT = "https://lite.realtime.nationalrail.co.uk/OpenLDBWS/ldb12.asmx"
 DARWIN_PARAMETER_NAME = "/berrylands/darwin-api-key"
@@ -18,8 +28,23 @@ REGION = "eu-west-1"
 # Cache API key (Lambda cold start only)
 _cached_api_key = None
 
+# Last good board per (origin, destination), served when the budget runs out
+_last_boards = {}
+
+# In-memory boards kept live by pushport.start_consumer() in long-running
+# processes; while the feed is live, covered stations skip the SOAP call
+live_boards = None
+
+
+def live_boards_for(origin):
+    """The Push Port boards if the feed is live and covers origin, else None."""
+    boards = live_boards
+    if boards is not None and boards.live() and boards.covers(origin):
+        return boards
+    return None
 
-def get_darwin_api_key():
+
+def get_darwin_api_key(deadline=None):
     """Get Darwin API key from Parameter Store (FREE!)."""
     global _cached_api_key
 
@@ -28,7 +53,10 @@ def get_darwin_api_key():
 
     try:
         import boto3
-        client = boto3.client('ssm', region_name=REGION)
+        from botocore.config import Config
+        timeout = upstream_timeout(deadline, 'Darwin API key lookup')
+        client = boto3.client('ssm', region_name=REGION, config=Config(
+            connect_timeout=timeout, read_timeout=timeout, retries={'total_max_attempts': 1}))
         response = client.get_parameter(
             Name=DARWIN_PARAMETER_NAME,
             WithDecryption=True
@@ -47,7 +75,7 @@ def get_darwin_api_key():
         return None
 
 
-def soap_request(api_key, from_station, to_station, num_services=6):
+def soap_request(api_key, from_station, to_station, num_services=6, deadline=None):
     """Make SOAP request to Darwin API (ldb12, WSDL version 2021-11-01)."""
     soap_body = f'''<?xml version="1.0" encoding="utf-8"?>
 <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
@@ -79,7 +107,7 @@ def soap_request(api_key, from_station, to_station, num_services=6):
         }
     )
 
-    with urllib.request.urlopen(req, timeout=10) as response:
+    with urllib.request.urlopen(req, timeout=upstream_timeout(deadline, 'Darwin fetch')) as response:
         return response.read().decode('utf-8')
 
 
@@ -150,53 +178,33 @@ def parse_darwin_response(xml_data, destination_crs='WAT'):
                     arrival_time = st_elem.text
                 stops = len(calling_points) - 1
 
+            # Times as minutes since midnight; formatted only when written out
+            std = hhmm_minutes(std_time)
+            arrival = hhmm_minutes(arrival_time)
+
             # Calculate journey minutes
             journey_mins = 0
-            if std_time and arrival_time:
-                try:
-                    std_mins = int(std_time[:2]) * 60 + int(std_time[3:5])
-                    arr_mins = int(arrival_time[:2]) * 60 + int(arrival_time[3:5])
-                    journey_mins = arr_mins - std_mins
-                    if journey_mins < 0:
-                        journey_mins += 1440  # Handle midnight crossing
-                except:
-                    pass
+            if isinstance(std, int) and isinstance(arrival, int):
+                journey_mins = arrival - std
+                if journey_mins < 0:
+                    journey_mins += 1440  # Handle midnight crossing
 
             # Calculate delay
             delay_mins = 0
-            expected_dep = std_time
+            expected = std
             if etd_time not in ('On time', 'Delayed', 'Cancelled', ''):
-                try:
-                    std_mins = int(std_time[:2]) * 60 + int(std_time[3:5])
-                    etd_mins = int(etd_time[:2]) * 60 + int(etd_time[3:5])
-                    delay_mins = etd_mins - std_mins
+                etd = hhmm_minutes(etd_time)
+                if isinstance(std, int) and isinstance(etd, int):
+                    delay_mins = etd - std
                     if delay_mins < -720:
                         delay_mins += 1440
-                    expected_dep = etd_time
-                except:
-                    pass
+                    expected = etd
 
             # Calculate ETA
-            eta = ''
-            if arrival_time:
-                try:
-                    arr_mins = int(arrival_time[:2]) * 60 + int(arrival_time[3:5])
-                    eta_mins = arr_mins + delay_mins
-                    eta = f"{(eta_mins // 60) % 24:02d}{eta_mins % 60:02d}"
-                except:
-                    pass
-
-            departures.append({
-                'scheduledDeparture': std_time.replace(':', ''),
-                'expectedDeparture': expected_dep.replace(':', ''),
-                'arrivalTime': arrival_time.replace(':', '') if arrival_time else '',
-                'eta': eta,
-                'journeyMins': journey_mins,
-                'stops': stops,
-                'delayMinutes': delay_mins,
-                'cancelled': cancelled,
-                'status': etd_time
-            })
+            eta = arrival + delay_mins if isinstance(arrival, int) else ''
+
+            departures.append(Departure(std, expected, arrival, eta, journey_mins, stops,
+                                        delay_mins, cancelled, etd_time))
 
         except Exception as e:
             print(f"Error parsing service: {e}")
@@ -205,7 +213,7 @@ def parse_darwin_response(xml_data, destination_crs='WAT'):
     return departures
 
 
-def fetch_departures(origin="sur", destination="wat", api_key=None):
+def fetch_departures(origin="sur", destination="wat", api_key=None, deadline=None):
     """
     Fetch train departures via Darwin API.
     origin/destination are CRS codes: sur=Surbiton, wat=Waterloo
@@ -218,8 +226,10 @@ def fetch_departures(origin="sur", destination="wat", api_key=None):
 
     try:
         print(f"Fetching Darwin data: {origin_upper} to {destination_upper}")
-        xml_response = soap_request(api_key, origin_upper, destination_upper)
+        xml_response = soap_request(api_key, origin_upper, destination_upper, deadline=deadline)
         print("Got Darwin response, parsing...")
+        if deadline:
+            deadline.check('Darwin parse')
         departures = parse_darwin_response(xml_response, destination_crs=destination_upper)
         print(f"Parsed {len(departures)} departures")
         return departures, None
@@ -228,22 +238,74 @@ def fetch_departures(origin="sur", destination="wat", api_key=None):
         return [], str(e)
 
 
+# Commute stations are always known; anything else comes from the compiled
+# station database (see stationdb.py) when it is deployed alongside.
 STATION_NAMES = {
     'sur': 'Surbiton',
     'wat': 'London Waterloo'
 }
+STATION_DB_PATH = os.environ.get(
+    'T3_STATION_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stations.db'))
 
 
-def format_json(departures, origin, destination):
-    """Format departures as JSON for API consumers."""
-    return json.dumps({
-        'originName': STATION_NAMES.get(origin.lower(), origin.upper()),
-        'destinationName': STATION_NAMES.get(destination.lower(), destination.upper()),
-        'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
-        'departures': departures
-    })
+def station_name(crs):
+    """Display name for a CRS code, falling back to the upper-cased code."""
+    name = STATION_NAMES.get(crs.lower())
+    if name:
+        return name
+    db = stationdb.open_db(STATION_DB_PATH)
+    record = db.get(crs) if db else None
+    return record[0] if record else crs.upper()
 
 
+def format_json(departures, origin, destination, age_seconds=None):
+    """Format departures as JSON for API consumers.
+
+    age_seconds marks a cached board served after a failed or late fetch.
+    """
+    # Written straight into one buffer; same output as json.dumps of the board dict
+    out = io.StringIO()
+    write = out.write
+    write('{"originName": ')
+    write(encode_basestring_ascii(station_name(origin)))
+    write(', "destinationName": ')
+    write(encode_basestring_ascii(station_name(destination)))
+    write(', "timestamp": "')
+    write(datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'))
+    write('", "departures": ')
+    write_departures(departures, write)
+    if age_seconds is None:
+        write(', "fresh": true}')
+    else:
+        write(f', "fresh": false, "ageSeconds": {age_seconds:d}}}')
+    return out.getvalue()
+
+
+def departures_with_fallback(origin, destination, api_key=None, deadline=None):
+    """
+    Fetch a board, falling back to the last good one for the same journey.
+    Returns (departures, age_seconds, error); age_seconds is None when fresh.
+    """
+    boards = live_boards_for(origin)
+    if boards is not None:
+        return boards.board(origin, destination), None, None
+
+    key = (origin.lower(), destination.lower())
+    departures, error = fetch_departures(origin, destination, api_key, deadline)
+    if not error:
+        _last_boards[key] = (time.time(), departures)
+        return departures, None, None
+
+    cached = _last_boards.get(key)
+    if not cached:
+        return [], None, error
+    fetched_at, departures = cached
+    age = int(time.time() - fetched_at)
+    print(f"Serving cached {origin.upper()}->{destination.upper()} board ({age}s old): {error}")
+    return departures, age, None
+
+
+@profiled
 def lambda_handler(event, context):
     """AWS Lambda entry point."""
     cors_headers = {
@@ -252,21 +314,24 @@ def lambda_handler(event, context):
         'Access-Control-Allow-Methods': 'GET,OPTIONS'
     }
 
+    deadline = Deadline.from_event(event, context)
+
+    # Get direction from query params
+    params = event.get('queryStringParameters') or {}
+    origin = params.get('from', 'sur')
+    destination = params.get('to', 'wat')
+
     # Get Darwin API key from Parameter Store (FREE!)
-    api_key = get_darwin_api_key()
-    if not api_key:
+    api_key = get_darwin_api_key(deadline)
+    if (not api_key and (origin.lower(), destination.lower()) not in _last_boards
+            and live_boards_for(origin) is None):
         return {
             'statusCode': 500,
             'body': json.dumps({'error': 'Darwin API key not configured'}),
             'headers': {'Content-Type': 'application/json', **cors_headers}
         }
 
-    # Get direction from query params
-    params = event.get('queryStringParameters') or {}
-    origin = params.get('from', 'sur')
-    destination = params.get('to', 'wat')
-
-    departures, error = fetch_departures(origin, destination, api_key)
+    departures, age_seconds, error = departures_with_fallback(origin, destination, api_key, deadline)
 
     if error:
         return {
@@ -275,11 +340,14 @@ def lambda_handler(event, context):
             'headers': {'Content-Type': 'application/json', **cors_headers}
         }
 
-    return {
+    # Unchanged boards reuse the last body (and its compressed bytes)
+    body = cached_body(('trains', origin.lower(), destination.lower(), age_seconds), departures,
+                       lambda: format_json(departures, origin, destination, age_seconds))
+    return compress_response(event, {
         'statusCode': 200,
-        'body': format_json(departures, origin, destination),
+        'body': body,
         'headers': {'Content-Type': 'application/json', **cors_headers}
-    }
+    })
 
 
 if __name__ == '__main__':